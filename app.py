@@ -7,10 +7,15 @@ import PyPDF2
 import docx
 from pathlib import Path
 import json
+import contextvars
+import logging
+import re
 from datetime import datetime
-from tinydb import TinyDB, Query
 import io
 import zipfile
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import markdown2
@@ -26,6 +31,29 @@ from scipy import stats
 from scipy.io import wavfile
 from scipy import signal
 
+# --- CHAT STORAGE ---
+from storage import (
+    init_database, create_new_session, get_sessions_page, count_sessions, search_sessions, save_message,
+    load_session_messages_page, delete_session, rename_session, get_session_name,
+    get_session_persona, update_session_persona, update_session_persona_description,
+    get_session_persona_description, get_session_persona_evolution,
+    get_session_context_summary, update_session_context_summary,
+    make_media_message, parse_media_message, load_media,
+    unit_of_work, archive_idle_sessions, collect_unreferenced_blobs, fork_session, count_session_messages, set_message_suggestions,
+    iter_session_messages, iter_chat_markdown, iter_chat_jsonl, write_chunks, write_session_zip, write_all_sessions_zip
+)
+from response_cache import ResponseCache
+from semantic_cache import SemanticCache
+from mock_model import MockModel, settings_from_env as mock_model_settings
+from model_client import ModelClient, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, caller_priority, set_caller
+from doc_oracle import (
+    DocumentIndex, DocumentLibrary, SUMMARY_SECTION_WORDS, citation, content_hash, format_excerpts,
+    split_for_summary, summary_key
+)
+
+logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+logging.getLogger("semantic_cache").setLevel(logging.INFO) # Log semantic cache match scores
+
 # --- CONSTANTS ---
 VISUALIZATION_INSTRUCTIONS = """
 When asked to create a plot or visualization, you MUST generate Python code using the `plotly` library.
@@ -52,115 +80,86 @@ PERSONAS = {
     "Cosmic Engineer": "You are a Cosmic Engineer, a highly efficient and practical AI. Your purpose is to provide clear, direct, and accurate information. For simple greetings or short questions, provide a concise and helpful response (e.g., for 'hi', respond with 'Hello. I am ♾️. How can I assist you, traveler?'). When the user asks for a description, explanation, or detailed information, provide a comprehensive and thorough essay-like response, breaking down complex topics into understandable parts. Prioritize efficiency and clarity in all communications, avoiding unnecessary embellishments but not sacrificing detail when required." + VISUALIZATION_INSTRUCTIONS
 }
 
+# Minimum prompt similarity for reusing an earlier answer of the same persona (semantic cache).
+# Creative personas only reuse near-verbatim repeats; personas missing here never use it.
+SEMANTIC_CACHE_THRESHOLDS = {
+    "Cosmic Intelligence": 0.85,
+    "Astrophysicist": 0.85,
+    "Cosmic Engineer": 0.85,
+    "Quantum Philosopher": 0.9,
+    "Sci-Fi Author": 0.97
+}
+
+# The Cognitive Twin re-evolves in the background after this many new user messages,
+# or sooner when their style drifts by more than the threshold (see `style_drift`).
+COGNITIVE_TWIN_EVOLVE_EVERY = 4
+COGNITIVE_TWIN_DRIFT_THRESHOLD = 0.3
+
+# Conversation memory sent with each chat reply: recent turns verbatim within this many (estimated)
+# tokens, older turns as a stored rolling summary of at most CONTEXT_SUMMARY_MAX_WORDS words.
+CONTEXT_HISTORY_TOKEN_BUDGET = 4000
+CONTEXT_SUMMARY_MAX_WORDS = 250
+
+# Models behind the chat and tools, and behind the Genesis Engine's image generation
+CHAT_MODEL = 'gemma-3-27b-it'
+IMAGE_MODEL = 'gemma-3-12b-it'
+
+# Offline load testing: with EVENT_HORIZON_MODEL_BACKEND=mock every model call is answered
+# locally by mock_model.MockModel (no API key needed), tuned by the EVENT_HORIZON_MOCK_* variables
+MOCK_MODEL_SETTINGS = mock_model_settings()
+
+# Default deadline of the long-running tools' generations (adjustable in the tools panel)
+TOOL_DEADLINE_SECONDS = 180
+
+# Document chunks sent with each Document Oracle question
+DOC_ORACLE_TOP_K = 6
+
+# Long uploads are summarized section by section, this many sections at a time,
+# into section summaries of at most this many words before they are combined
+DOC_ORACLE_SUMMARY_WORKERS = 4
+DOC_ORACLE_SECTION_SUMMARY_WORDS = 400
+
 # --- PAGE CONFIG ---
 st.set_page_config(page_title="evEnt HorizoN", page_icon="♾️", layout="centered")
 
 # --- CONFIGURE GEMINI API ---
+@st.cache_resource
+def get_response_cache():
+    """Disk-backed cache of model responses, shared by every session of this server process."""
+    return ResponseCache()
+
+@st.cache_resource
+def get_semantic_cache():
+    """Near-duplicate prompt cache of chat answers, shared by every session of this server process."""
+    return SemanticCache()
+
+@st.cache_resource
+def get_document_library():
+    """On-disk library of extracted Document Oracle texts and summaries, shared by every session."""
+    return DocumentLibrary()
+
+@st.cache_resource(max_entries=32)
+def get_document_index(documents):
+    """BM25 index over library documents given as (name, content hash) pairs, shared by sessions asking about the same set."""
+    library = get_document_library()
+    return DocumentIndex.from_documents([(name, library.get_pages(key) or []) for name, key in documents])
+
+@st.cache_resource
+def get_model_client():
+    """Client for every model call (pooled handles, deadlines, retries), shared by every session of this server process."""
+    # Repeated identical requests (same persona, prompt and attachments) are answered from the response cache
+    if MOCK_MODEL_SETTINGS is not None:
+        return ModelClient(cache=get_response_cache(), default_model=CHAT_MODEL,
+                           backend=MockModel.factory(**MOCK_MODEL_SETTINGS))
+    return ModelClient(cache=get_response_cache(), default_model=CHAT_MODEL)
+
 try:
-    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-    model = genai.GenerativeModel('gemma-3-27b-it')
+    if MOCK_MODEL_SETTINGS is None:
+        genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+    model_client = get_model_client()
 except Exception as e:
     st.error(f"⚠️ API Configuration Error: {str(e)}")
 
-# --- DATABASE FUNCTIONS ---
-def init_database():
-    """Initialize TinyDB database for chat history."""
-    db = TinyDB('cosmic_chats.json')
-    return db
-
-def create_new_session(db, session_name=None, persona_name="Cosmic Intelligence"):
-    """Create a new chat session."""
-    if session_name is None:
-        session_name = f"Cosmic Chat {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    
-    sessions_table = db.table('sessions')
-    session_id = sessions_table.insert({
-        'session_name': session_name,
-        'persona_name': persona_name,
-        'created_at': datetime.now().isoformat(),
-        'messages': [],
-        'dynamic_persona_description': None
-    })
-    return session_id
-
-def get_all_sessions(db):
-    """Get all chat sessions."""
-    sessions_table = db.table('sessions')
-    sessions = sessions_table.all()
-    sessions.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    return sessions
-
-def save_message(db, session_id, role, content, files=None, suggestions=None):
-    """Save a message to the database."""
-    sessions_table = db.table('sessions') 
-    Session = Query()
-    
-    session = sessions_table.get(doc_id=session_id)
-    if session:
-        message = {
-            'role': role,
-            'content': content,
-            'timestamp': datetime.now().isoformat()
-        }
-        if files:
-            message['files'] = files
-        if suggestions:
-            message['suggestions'] = suggestions
-        
-        messages = session.get('messages', [])
-        messages.append(message)
-        sessions_table.update({'messages': messages}, doc_ids=[session_id])
-        return message
-
-def load_session_messages(db, session_id):
-    """Load all messages for a session."""
-    sessions_table = db.table('sessions')
-    session = sessions_table.get(doc_id=session_id)
-    
-    if session:
-        messages = []
-        for msg in session.get('messages', []):
-            message = {
-                'role': msg['role'],
-                'content': msg['content'],
-                'timestamp': msg.get('timestamp', datetime.now().isoformat())
-            }
-            if 'files' in msg:
-                message['files'] = msg['files']
-            if 'suggestions' in msg:
-                message['suggestions'] = msg['suggestions']
-            messages.append(message)
-        return messages
-    return []
-
-def delete_session(db, session_id):
-    """Delete a chat session."""
-    sessions_table = db.table('sessions')
-    sessions_table.remove(doc_ids=[session_id])
-
-def rename_session(db, session_id, new_name):
-    """Rename a chat session."""
-    sessions_table = db.table('sessions')
-    sessions_table.update({'session_name': new_name}, doc_ids=[session_id])
-
-def get_session_name(db, session_id):
-    """Get session name by ID."""
-    sessions_table = db.table('sessions')
-    session = sessions_table.get(doc_id=session_id)
-    return session.get('session_name', 'Unknown') if session else 'Unknown'
-
-def get_session_persona(db, session_id):
-    """Get session persona by ID."""
-    sessions_table = db.table('sessions')
-    session = sessions_table.get(doc_id=session_id)
-    return session.get('persona_name', 'Cosmic Intelligence') if session else 'Cosmic Intelligence'
-
-def update_session_persona(db, session_id, new_persona_name):
-    """Update the persona for a specific chat session."""
-    sessions_table = db.table('sessions')
-    if sessions_table.get(doc_id=session_id):
-        sessions_table.update({'persona_name': new_persona_name}, doc_ids=[session_id])
-
 # --- VISUALIZATION THEMES ---
 COSMIC_THEMES = {
     'Nebula Burst': {
@@ -307,6 +306,38 @@ def display_export_buttons(content, base_filename):
         pdf_buffer = create_pdf_from_markdown(content, base_filename)
         st.download_button("📥 PDF", pdf_buffer, f"{base_filename}.pdf", "application/pdf", use_container_width=True, help="Download as formatted PDF file.", disabled=(pdf_buffer is None))
 
+def display_chat_export_buttons(db, session_id, session_name):
+    """Displays chat history export options. The chosen export is built only when requested and offered for one download."""
+    st.markdown("##### 💾 Export Options")
+    safe_filename = "".join(c for c in session_name if c.isalnum() or c in (' ', '_')).rstrip().replace(' ', '_')
+
+    def write_session_zip_to(path):
+        with open(path, 'wb') as zip_file:
+            write_session_zip(db, session_id, session_name, zip_file)
+
+    def write_all_sessions_zip_to(path):
+        with open(path, 'wb') as zip_file:
+            write_all_sessions_zip(db, zip_file)
+
+    # label: (file name, MIME type, writes the export to a path)
+    export_kinds = {
+        "This chat (Markdown)": (f"{safe_filename}.md", "text/markdown",
+                                 lambda path: write_chunks(iter_chat_markdown(iter_session_messages(db, session_id), session_name), path)),
+        "This chat (JSONL)": (f"{safe_filename}.jsonl", "application/jsonl",
+                              lambda path: write_chunks(iter_chat_jsonl(iter_session_messages(db, session_id)), path)),
+        "This chat with media (ZIP)": (f"{safe_filename}.zip", "application/zip", write_session_zip_to),
+        "All chats with media (ZIP)": ("cosmic_chat_history.zip", "application/zip", write_all_sessions_zip_to),
+    }
+    kind = st.selectbox("Export", list(export_kinds), key="chat_export_kind", label_visibility="collapsed")
+    if st.button("📦 Prepare Export", use_container_width=True, help="Stream the chosen export to a file and offer it for download."):
+        file_name, mime, write_export = export_kinds[kind]
+        with st.spinner("📦 Packing your cosmic history..."), tempfile.TemporaryDirectory() as export_dir:
+            path = os.path.join(export_dir, file_name)
+            write_export(path)
+            # Shown for this run only; clicking it must not rerun the script and rebuild the export
+            with open(path, 'rb') as f:
+                st.download_button(f"📥 {file_name}", f, file_name, mime, use_container_width=True, on_click="ignore")
+
 # --- DATA TOOL FUNCTIONS ---
 def statistical_analysis(df):
     """Generate comprehensive statistical analysis"""
@@ -661,14 +692,15 @@ def set_page_background_and_style(file_path):
     '''
     st.markdown(css_text, unsafe_allow_html=True)
 
+def extract_pages_from_pdf(pdf_file):
+    """Extract the text of each page of a PDF file."""
+    pdf_reader = PyPDF2.PdfReader(pdf_file)
+    return [page.extract_text() for page in pdf_reader.pages]
+
 def extract_text_from_pdf(pdf_file):
     """Extract text from PDF file."""
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        return "\n".join(extract_pages_from_pdf(pdf_file)).strip()
     except Exception as e:
         return f"Error reading PDF: {str(e)}"
 
@@ -731,11 +763,33 @@ Data columns and types:
     except Exception as e:
         return f"Error processing file: {str(e)}", "error"
 
-def generate_cognitive_twin_persona(user_messages_text):
-    """Analyzes user text and generates a dynamic persona description for the AI."""
-    if not user_messages_text.strip():
-        # Initial persona for the very first message
-        return "You are a nascent Cognitive Twin, just beginning to understand the user. Be curious, open, and ask clarifying questions to learn their communication style. Your goal is to eventually mirror their way of thinking and communicating." + "\n" + VISUALIZATION_INSTRUCTIONS
+NASCENT_TWIN_PERSONA = "You are a nascent Cognitive Twin, just beginning to understand the user. Be curious, open, and ask clarifying questions to learn their communication style. Your goal is to eventually mirror their way of thinking and communicating." + "\n" + VISUALIZATION_INSTRUCTIONS
+
+def cognitive_twin_context(description):
+    """System context for a Cognitive Twin reply: the evolved persona, or the nascent one before the first evolution."""
+    return description or NASCENT_TWIN_PERSONA
+
+def generate_cognitive_twin_persona(new_user_text, previous_description=None):
+    """Analyzes user text and generates a dynamic persona description for the AI.
+
+    The previous description acts as a rolling summary of the user's earlier
+    messages, so only the messages since the last evolution are sent.
+    """
+    if not new_user_text.strip():
+        return cognitive_twin_context(previous_description)
+
+    previous_persona = previous_description.replace(VISUALIZATION_INSTRUCTIONS, "").strip() if previous_description else ""
+    if previous_persona:
+        evolution_task = f"""Below is the current persona description, which summarizes the user's earlier messages, followed by the user's newest messages. Refine the description with what the new messages reveal: keep what still holds, update what has changed, and keep it concise.
+
+**Current AI Persona Description:**
+---
+{previous_persona}
+---
+
+**User's New Messages:**"""
+    else:
+        evolution_task = "**User's Accumulated Text:**"
 
     persona_generation_prompt = f"""
 You are an expert in psycholinguistics and communication style analysis.
@@ -749,36 +803,216 @@ Analyze the provided text from the user to understand their communication and th
 
 Based on your analysis, write a concise set of instructions for an AI. This persona description should guide the AI to mirror the user's style, creating a hyper-personalized intellectual partner. The description MUST start with "You are a Cognitive Twin to the user." Do not add any preamble.
 
-**User's Accumulated Text:**
+{evolution_task}
 ---
-{user_messages_text}
+{new_user_text}
 ---
 
 **AI Persona Description (Instructions for the AI):**
 """
     try:
-        response = model.generate_content(persona_generation_prompt)
+        response = model_client.generate(persona_generation_prompt)
         # Add the visualization instructions back in, as they are not part of the persona generation
         return response.text.strip() + "\n" + VISUALIZATION_INSTRUCTIONS
     except Exception as e:
+        if previous_description:
+            return previous_description # Keep the current persona; the next evolution retries
         # Fallback persona in case of an error during evolution
         fallback_persona = f"You are a Cognitive Twin to the user, but an error occurred during persona evolution: {e}. Default to being an adaptive, curious, and helpful assistant."
         return fallback_persona + "\n" + VISUALIZATION_INSTRUCTIONS
 
-def get_cosmic_response(prompt, cosmic_context, parts=None):
-    """Generate response using Gemini API with multi-modal context."""
+def style_profile(texts):
+    """Cheap local stylometric fingerprint of some user messages (no model call)."""
+    text = "\n".join(texts)
+    words = re.findall(r"[^\W\d_]+(?:'[^\W\d_]+)?", text)
+    sentences = [sentence for sentence in re.split(r'[.!?\n]+', text) if sentence.strip()]
+    letters = [c for c in text if c.isalpha()]
+    return {
+        'words_per_sentence': len(words) / max(1, len(sentences)),
+        'word_length': sum(len(word) for word in words) / max(1, len(words)),
+        'vocabulary_richness': len({word.lower() for word in words}) / max(1, len(words)),
+        'questions': text.count('?') / max(1, len(sentences)),
+        'exclamations': text.count('!') / max(1, len(sentences)),
+        'uppercase': sum(c.isupper() for c in letters) / max(1, len(letters)),
+        'non_ascii': sum(ord(c) > 127 for c in text) / max(1, len(text)) # Emoji, accents, other scripts
+    }
+
+def style_drift(old_style, new_style):
+    """Mean change between two style profiles: absolute for ratios, relative for lengths (0 = same style)."""
+    changes = [
+        abs(new_style[name] - old_style[name]) / max(abs(old_style[name]), abs(new_style[name]), 1.0)
+        for name in old_style if name in new_style
+    ]
+    return sum(changes) / len(changes) if changes else 0.0
+
+def evolve_cognitive_twin(session_id):
+    """Background task: refine a session's Cognitive Twin persona from the messages added since it last evolved.
+
+    The model is only called for the first evolution, every
+    COGNITIVE_TWIN_EVOLVE_EVERY new user messages, or when the user's style
+    drifts from the profile the persona was built for. Returns True if the
+    persona was re-evolved.
+    """
+    db = init_database()
+    description, evolved_at, style = get_session_persona_evolution(db, session_id)
+    new_messages = list(iter_session_messages(db, session_id, start=evolved_at))
+    new_user_texts = [msg['content'] for msg in new_messages if msg['role'] == 'user']
+    if not new_user_texts:
+        return False
+
+    new_style = style_profile(new_user_texts)
+    drifted = style is not None and len(new_user_texts) >= 2 and style_drift(style, new_style) > COGNITIVE_TWIN_DRIFT_THRESHOLD
+    if description and len(new_user_texts) < COGNITIVE_TWIN_EVOLVE_EVERY and not drifted:
+        return False
+
+    evolved = generate_cognitive_twin_persona("\n".join(new_user_texts), description)
+    if evolved == description:
+        return False # Evolution failed; the same messages are retried next time
+    # The stored profile rolls forward: half the earlier style, half the newest messages
+    rolling_style = {name: (style[name] + value) / 2 for name, value in new_style.items()} if style else new_style
+    update_session_persona_description(db, session_id, evolved, evolved_at + len(new_messages), rolling_style)
+    return True
+
+def estimate_tokens(text):
+    """Local token estimate (about four characters per token), no tokenizer or API call needed."""
+    return (len(text) + 3) // 4
+
+def format_turn(message):
+    """One message as a line of conversation history; media is reduced to its description."""
+    speaker = "User" if message['role'] == 'user' else "AI"
+    media = parse_media_message(message['content'])
+    text = f"[{media[0]}] {media[2]}" if media else message['content']
+    return f"{speaker}: {text}"
+
+def build_conversation_history(db, session_id, token_budget=CONTEXT_HISTORY_TOKEN_BUDGET):
+    """Conversation memory for the next reply: the stored summary of older turns plus recent turns verbatim.
+
+    Recent turns are read newest first, one page at a time, and only those
+    not yet covered by the summary and fitting `token_budget` are included.
+    Returns "" for a new conversation.
+    """
+    summary, summarized_count = get_session_context_summary(db, session_id)
+    unsummarized = count_session_messages(db, session_id) - summarized_count
+    recent_turns = []
+    remaining_budget = token_budget
+    cursor = None
+    while unsummarized > 0:
+        page, cursor = load_session_messages_page(db, session_id, limit=MESSAGE_PAGE_SIZE, before=cursor)
+        for message in reversed(page[-unsummarized:]):
+            turn = format_turn(message)
+            remaining_budget -= estimate_tokens(turn)
+            if remaining_budget < 0:
+                break
+            recent_turns.append(turn)
+            unsummarized -= 1
+        if remaining_budget < 0 or cursor is None:
+            break
+
+    sections = []
+    if summary:
+        sections.append(f"**Summary of the Earlier Conversation:**\n{summary}")
+    if recent_turns:
+        sections.append("**Recent Conversation:**\n" + "\n\n".join(reversed(recent_turns)))
+    return "\n\n".join(sections)
+
+def summarize_conversation(previous_summary, messages):
+    """Fold some conversation turns into the rolling summary. Returns None if the model call fails."""
+    turns = "\n\n".join(format_turn(message) for message in messages)
+    earlier = f"**Summary So Far:**\n{previous_summary}\n\n" if previous_summary else ""
+    summary_prompt = f"""You maintain the memory of a long conversation between a user and an AI assistant.
+Update the summary so that it also covers the new turns below. Keep the facts, names, numbers, decisions, open questions and the user's goals that later replies may need; drop small talk. Write at most {CONTEXT_SUMMARY_MAX_WORDS} words of plain prose and return only the summary.
+
+{earlier}**New Turns:**
+---
+{turns}
+---"""
     try:
-        request_parts = [cosmic_context, "\n\n---", f"\n\n**User's Query:** {prompt}"]
-        
-        if parts:
-            request_parts.append("\n\n**Attached Context:**\n")
-            request_parts.extend(parts)
+        return model_client.generate(summary_prompt).text.strip()
+    except Exception:
+        return None
+
+def update_conversation_summary(session_id):
+    """Background task: fold the oldest unsummarized turns into the stored summary once they outgrow the budget.
 
-        response = model.generate_content(request_parts)
+    Summaries run when the unsummarized turns pass three quarters of
+    CONTEXT_HISTORY_TOKEN_BUDGET and cover everything but the newest half of
+    it, so one summary call serves several turns and the verbatim history
+    always fits. Returns True if the summary was updated.
+    """
+    db = init_database()
+    summary, summarized_count = get_session_context_summary(db, session_id)
+    pending = list(iter_session_messages(db, session_id, start=summarized_count))
+    token_counts = [estimate_tokens(format_turn(message)) for message in pending]
+    if sum(token_counts) <= CONTEXT_HISTORY_TOKEN_BUDGET * 3 // 4:
+        return False
+
+    kept_tokens, split = 0, len(pending)
+    while split > 0 and kept_tokens + token_counts[split - 1] <= CONTEXT_HISTORY_TOKEN_BUDGET // 2:
+        split -= 1
+        kept_tokens += token_counts[split]
+    new_summary = summarize_conversation(summary, pending[:split])
+    if not new_summary:
+        return False
+    update_session_context_summary(db, session_id, new_summary, summarized_count + split)
+    return True
+
+def build_cosmic_request(prompt, cosmic_context, parts=None, history=None):
+    """Assemble the persona, conversation history, query and attachments into Gemini request parts."""
+    request_parts = [cosmic_context]
+    if history:
+        request_parts.append(f"\n\n---\n\n{history}")
+    request_parts += ["\n\n---", f"\n\n**User's Query:** {prompt}"]
+    
+    if parts:
+        request_parts.append("\n\n**Attached Context:**\n")
+        request_parts.extend(parts)
+    return request_parts
+
+def semantic_cache_threshold(persona_name, parts=None, history=None):
+    """Similarity threshold for reusing answers of this persona, or None if the semantic cache does not apply."""
+    if parts or history:
+        return None # Attachments and earlier turns change the question in ways the prompt text does not show
+    return SEMANTIC_CACHE_THRESHOLDS.get(persona_name)
+
+def get_cosmic_response(prompt, cosmic_context, parts=None, persona_name=None, history=None):
+    """Generate response using Gemini API with multi-modal context.
+
+    `history` is conversation memory from `build_conversation_history`. With a
+    `persona_name`, answers to near-identical earlier opening prompts are
+    reused from the semantic cache.
+    """
+    threshold = semantic_cache_threshold(persona_name, parts, history)
+    if threshold is not None:
+        match = get_semantic_cache().lookup(cosmic_context, prompt, threshold)
+        if match:
+            return match[0]
+    try:
+        response = model_client.generate(build_cosmic_request(prompt, cosmic_context, parts, history))
+        if threshold is not None:
+            get_semantic_cache().store(cosmic_context, prompt, response.text)
         return response.text
     except Exception as e:
         return f"✨ The cosmic signals are unclear: {str(e)}"
 
+def stream_cosmic_response(prompt, cosmic_context, parts=None, persona_name=None, history=None):
+    """Like `get_cosmic_response`, but yield the text chunk by chunk as Gemini generates it."""
+    threshold = semantic_cache_threshold(persona_name, parts, history)
+    if threshold is not None:
+        match = get_semantic_cache().lookup(cosmic_context, prompt, threshold)
+        if match:
+            yield match[0]
+            return
+    try:
+        texts = []
+        request = build_cosmic_request(prompt, cosmic_context, parts, history)
+        for text in model_client.stream(request, priority=PRIORITY_INTERACTIVE):
+            texts.append(text)
+            yield text
+        if threshold is not None and texts:
+            get_semantic_cache().store(cosmic_context, prompt, "".join(texts))
+    except Exception as e:
+        yield f"✨ The cosmic signals are unclear: {str(e)}"
+
 def get_follow_up_suggestions(prompt, response):
     """Generate follow-up questions using the Gemini API."""
     try:
@@ -791,7 +1025,7 @@ def get_follow_up_suggestions(prompt, response):
         Return as JSON list of strings.
         Example: ["What is a singularity?", "How do black holes evaporate?", "Are wormholes real?"]
         """
-        suggestion_response = model.generate_content(suggestion_prompt)
+        suggestion_response = model_client.generate(suggestion_prompt)
         json_part = suggestion_response.text.strip().replace("```json", "").replace("```", "")
         suggestions = json.loads(json_part)
         if isinstance(suggestions, list) and all(isinstance(s, str) for s in suggestions):
@@ -800,62 +1034,144 @@ def get_follow_up_suggestions(prompt, response):
     except Exception as e:
         return []
 
+def generate_and_save_suggestions(session_id, timestamp, prompt, response):
+    """Background task: generate follow-up suggestions for a saved reply and store them with it."""
+    suggestions = get_follow_up_suggestions(prompt, response)
+    if suggestions:
+        set_message_suggestions(init_database(), session_id, timestamp, suggestions)
+    return suggestions
+
+def document_summary_prompt(content, from_sections=False):
+    """Prompt for the final structured Document Oracle summary, of either full documents or section summaries."""
+    source = ("summaries of consecutive sections of the following document(s), in order"
+              if from_sections else "the following document(s)")
+    return f"""
+You are a "Document Oracle," an AI expert in synthesizing information.
+Your task is to read {source} and provide a comprehensive, structured summary.
+
+**INSTRUCTIONS:**
+1.  **Identify Key Themes:** Determine the main topics, arguments, and conclusions.
+2.  **Create a Structured Summary:** Organize the summary with clear headings and bullet points.
+3.  **Extract Actionable Insights:** Pull out key takeaways, recommendations, or data points.
+4.  **Output Format:** Your response should be in Markdown.
+
+**Document Content:**
+{content}
+
+Begin your summary.
+"""
+
+def section_summary_prompt(name, part, part_count, text):
+    """Map step prompt: summarize one section of a document.
+
+    The prompt depends only on that section, so the response cache answers it
+    again whenever the same document is summarized, alone or with others.
+    """
+    return f"""You are summarizing part {part} of {part_count} of the document "{name}" so that the part summaries can later be combined.
+Keep the main topics, arguments, conclusions, key facts, figures and recommendations; drop repetition and filler.
+Write at most {DOC_ORACLE_SECTION_SUMMARY_WORDS} words as Markdown bullet points and return only the summary.
+
+**Section Content:**
+---
+{text}
+---"""
+
+def condense_prompt(summaries):
+    """Intermediate reduce step prompt: merge several consecutive section summaries into one."""
+    joined = "\n\n".join(summaries)
+    return f"""Merge the following summaries of consecutive document sections into one summary of at most {DOC_ORACLE_SECTION_SUMMARY_WORDS} words.
+Keep the main topics, arguments, conclusions, key facts and figures, and which document they come from. Use Markdown bullet points under a "### " heading naming the document(s) and parts, and return only the summary.
+
+{joined}"""
+
+def summarize_documents(documents, on_progress=None):
+    """Summarize (name, text) documents, map-reduce style when they are too long for one prompt.
+
+    Each document is split into sections of at most SUMMARY_SECTION_WORDS
+    words, which are summarized concurrently. The section summaries are merged
+    in groups until they fit one prompt, then combined into the final
+    structured summary. `on_progress(done, total)` is called on the calling
+    thread after each section.
+    """
+    sections = []
+    for name, text in documents:
+        parts = split_for_summary(text)
+        sections.extend((name, part, len(parts), section) for part, section in enumerate(parts, start=1))
+    if len(sections) <= 1:
+        full_text = "\n\n".join(f"--- Content from {name} ---\n{text}" for name, text in documents)
+        return model_client.generate(document_summary_prompt(full_text)).text
+
+    responses = model_client.generate_many(
+        [section_summary_prompt(*section) for section in sections],
+        on_done=on_progress, concurrency=DOC_ORACLE_SUMMARY_WORKERS
+    )
+    summaries = [
+        f"### {name} (part {part} of {part_count})\n" + response.text.strip()
+        for (name, part, part_count, _), response in zip(sections, responses)
+    ]
+    while len(summaries) > 1 and sum(len(summary.split()) for summary in summaries) > SUMMARY_SECTION_WORDS:
+        groups, group_words = [[]], 0
+        for summary in summaries:
+            words = len(summary.split())
+            if groups[-1] and group_words + words > SUMMARY_SECTION_WORDS:
+                groups.append([])
+                group_words = 0
+            groups[-1].append(summary)
+            group_words += words
+        if len(groups) == len(summaries):
+            break  # Nothing to merge; the final prompt gets them as they are
+        merged = iter(model_client.generate_many(
+            [condense_prompt(group) for group in groups if len(group) > 1], concurrency=DOC_ORACLE_SUMMARY_WORKERS
+        ))
+        summaries = [next(merged).text.strip() if len(group) > 1 else group[0] for group in groups]
+    return model_client.generate(document_summary_prompt("\n\n".join(summaries), from_sections=True)).text
+
+def art_request(prompt, negative_prompt=None):
+    """Prompt parts asking the image model for art of `prompt`."""
+    # The model appears to be behaving like a text model. Prepending the prompt
+    # with an explicit instruction to generate an image might help guide it if
+    # it's a multi-modal model that is defaulting to a text response.
+    enhanced_prompt = f"Generate an image: A cinematic, high-detail, photorealistic masterpiece, 8k resolution: {prompt}"
+
+    final_prompt_parts = [enhanced_prompt]
+    if negative_prompt:
+        final_prompt_parts.append(f"Negative prompt: {negative_prompt}")
+    return final_prompt_parts
+
+def parse_art_response(response):
+    """Return (image bytes or None, description or error message) from an image model response."""
+    image_bytes = None
+    description = "No description was generated."
+
+    if response.candidates and response.candidates[0].content.parts:
+        for part in response.candidates[0].content.parts:
+            # The model can return text and image in any order.
+            if hasattr(part, 'inline_data') and part.inline_data:
+                image_bytes = part.inline_data.data
+            elif hasattr(part, 'text') and part.text:
+                description = part.text
+    
+    if image_bytes:
+        return image_bytes, description
+    else:
+        if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
+            return None, f"Image generation blocked. Reason: {response.prompt_feedback.block_reason.name}"
+        
+        if description and description != "No description was generated.":
+            return None, f"The model returned text instead of an image: \"{description}\""
+        return None, "Sorry, I couldn't generate an image. The model may not have returned any data."
+
 def generate_art_from_text(prompt, negative_prompt=None):
     """Generate art and a description using the Gemini image generation model."""
     try:
-        # This model name is correct for image generation.
-        image_model = genai.GenerativeModel("gemma-3-12b-it")
-        
-        # The model appears to be behaving like a text model. Prepending the prompt
-        # with an explicit instruction to generate an image might help guide it if
-        # it's a multi-modal model that is defaulting to a text response.
-        enhanced_prompt = f"Generate an image: A cinematic, high-detail, photorealistic masterpiece, 8k resolution: {prompt}"
-
-        final_prompt_parts = [enhanced_prompt]
-        if negative_prompt:
-            final_prompt_parts.append(f"Negative prompt: {negative_prompt}")
-
         # For this image generation model, requesting both image and text is implicit.
         # We remove the generation_config, and the model will return both parts
         # if it generates a description.
-        response = image_model.generate_content(
-            final_prompt_parts
-        )
-        
-        image_bytes = None
-        description = "No description was generated."
-
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                # The model can return text and image in any order.
-                if hasattr(part, 'inline_data') and part.inline_data:
-                    image_bytes = part.inline_data.data
-                elif hasattr(part, 'text') and part.text:
-                    description = part.text
-        
-        if image_bytes:
-            return image_bytes, description
-        else:
-            if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-                return None, f"Image generation blocked. Reason: {response.prompt_feedback.block_reason.name}"
-            
-            if description and description != "No description was generated.":
-                return None, f"The model returned text instead of an image: \"{description}\""
-            return None, "Sorry, I couldn't generate an image. The model may not have returned any data."
-            
+        response = model_client.generate(art_request(prompt, negative_prompt), model_name=IMAGE_MODEL, use_cache=False)
+        return parse_art_response(response)
     except Exception as e:
         return None, f"🎨 Cosmic interference during image generation: {str(e)}"
 
-def format_chat_as_markdown(messages, session_name):
-    """Formats a list of chat messages into a Markdown string."""
-    md_string = f"# Chat History: {session_name}\n\n"
-    for message in messages:
-        role = "🧑‍🚀 User" if message["role"] == "user" else "🌌 AI"
-        md_string += f"**{role}:**\n"
-        md_string += f"{message['content']}\n\n"
-        md_string += "---\n\n"
-    return md_string
-
 def perform_precognitive_analysis(df, db):
     """Performs a one-shot analysis of the dataframe and returns a consolidated report."""
     
@@ -961,8 +1277,31 @@ check_password()
 # Initialize database
 db = init_database()
 
+# Sessions idle for longer than this are compressed out of the hot database
+ARCHIVE_AFTER_DAYS = 30
+
+@st.cache_resource
+def get_background_executor():
+    """Thread pool for model calls kept off the chat's critical path (one per server process)."""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="cosmic-background")
+
+@st.cache_resource(ttl=24 * 60 * 60)
+def archive_cold_sessions(max_idle_days):
+    """Archive idle sessions and collect unreferenced media in the background, at most once a day per server process."""
+    def maintain():
+        # The worker opens its own connection; archival and its VACUUM never hold up a page load
+        worker_db = init_database()
+        archived = archive_idle_sessions(worker_db, max_idle_days=max_idle_days)
+        collect_unreferenced_blobs(worker_db)
+        return archived
+    return get_background_executor().submit(maintain)
+
+archive_cold_sessions(ARCHIVE_AFTER_DAYS)
+
 # --- CONSTANTS FOR CALLBACKS ---
 CANVAS_MODE_OPTION = "🎨 Image Generation (Canvas)"
+MESSAGE_PAGE_SIZE = 20 # Messages loaded and rendered per page of the transcript
+HISTORY_PAGE_SIZE = 10 # Sessions shown per page of the sidebar history
 
 # --- CALLBACKS ---
 def on_mode_change():
@@ -975,14 +1314,203 @@ def on_mode_change():
         st.session_state.canvas_mode = False
         st.session_state.selected_persona = selected_mode
         # Also update the current session's persona in the DB if a session is active
+        # Callbacks can run on a different script thread than the run that defined `db`; use this thread's connection
         if st.session_state.current_session_id:
-            update_session_persona(db, st.session_state.current_session_id, selected_mode)
+            update_session_persona(init_database(), st.session_state.current_session_id, selected_mode)
+
+@st.fragment(run_every=1)
+def poll_pending_suggestions():
+    """Show follow-up suggestions once their background task finishes, rerunning the app to render them."""
+    pending = st.session_state.pending_suggestions
+    finished = {timestamp: future for timestamp, future in pending.items() if future.done()}
+    if not finished:
+        st.caption("💡 Thinking of follow-up questions...")
+        return
+    for message in st.session_state.messages:
+        future = finished.get(message['timestamp'])
+        if future is not None and message['role'] == 'assistant':
+            message['suggestions'] = [] if future.exception() else future.result()
+    for timestamp in finished:
+        del pending[timestamp]
+    st.rerun()
+
+@st.fragment(run_every=2)
+def show_model_queue():
+    """Show how many model calls are queued behind the rate limit, and how long calls wait."""
+    stats = model_client.queue_stats()
+    if MOCK_MODEL_SETTINGS is not None:
+        st.caption("🧪 Offline mock model backend: answers are canned, not generated.")
+    if stats['waiting'] or stats['average_wait'] >= 1:
+        st.caption(
+            f"🛰️ Model queue: {stats['waiting']} waiting · {stats['active']} in flight · "
+            f"avg wait {stats['average_wait']:.1f}s (max {stats['max_recent_wait']:.1f}s)"
+        )
+
+def submit_background_task(function, *args):
+    """Run `function(*args)` on the background executor; its model calls queue as this user's background work."""
+    context = contextvars.copy_context()
+    context.run(set_caller, st.session_state.user_id, PRIORITY_BACKGROUND)
+    return get_background_executor().submit(context.run, function, *args)
+
+def start_tool_job(tool, requests):
+    """Start a tool's generations in the background as one cancellable job.
+
+    `requests` maps a name to (contents, options for `ModelClient.start`);
+    all of them share the deadline chosen in the tools panel.
+    """
+    st.session_state.tool_notices.pop(tool, None)
+    st.session_state.tool_jobs[tool] = {
+        name: model_client.start(contents, timeout=st.session_state.tool_deadline, **options)
+        for name, (contents, options) in requests.items()
+    }
+
+@st.fragment(run_every=1)
+def watch_tool_job(tool, label, on_finish, preview=None):
+    """Show a tool's running job, with the text streamed so far by its `preview` generation and a Cancel button.
+
+    Once every generation has finished, or on Cancel, `on_finish(generations)`
+    stores the results and the app reruns to show them.
+    """
+    generations = st.session_state.tool_jobs.get(tool)
+    if generations is None:
+        return
+    if st.button("✋ Cancel", key=f"cancel_{tool}", use_container_width=True):
+        for generation in generations.values():
+            generation.cancel()
+    if all(generation.done() for generation in generations.values()):
+        del st.session_state.tool_jobs[tool]
+        on_finish(generations)
+        st.rerun()
+
+    elapsed = max(generation.elapsed for generation in generations.values())
+    st.caption(f"{label} {elapsed:.0f}s (deadline {st.session_state.tool_deadline}s)")
+    if preview and generations[preview].text:
+        with st.container(height=300):
+            st.markdown(generations[preview].text)
+
+def tool_job_failure(generation, failure):
+    """Why a finished tool generation has no complete result, or None if it succeeded."""
+    if generation.cancelled():
+        return "⏹️ Cancelled"
+    error = generation.exception()
+    if isinstance(error, TimeoutError):
+        return f"⏱️ Stopped at the {generation.timeout}s deadline"
+    if error is not None:
+        return f"{failure}: {error}"
+    return None
+
+def tool_job_text(generation, failure):
+    """Text of a finished streamed tool generation.
+
+    Partial text is kept, marked as such, when the generation was cancelled or
+    failed midway; None if it was cancelled before any text arrived.
+    """
+    note = tool_job_failure(generation, failure)
+    if note is None:
+        return generation.result()
+    if not generation.text:
+        return None if generation.cancelled() else note
+    return f"{generation.text}\n\n---\n*{note} — the output above is partial.*"
+
+def show_tool_notice(tool):
+    """Explain why a tool's last job left no result, with any partial output it produced."""
+    notice = st.session_state.tool_notices.get(tool)
+    if notice:
+        message, partial = notice
+        st.warning(message)
+        if partial:
+            with st.expander("Partial output"):
+                st.code(partial, language="plaintext")
+
+def finish_genesis_engine(generations):
+    """Unpack the Genesis Engine's JSON answer into the files offered for download."""
+    generation = generations['files']
+    failure = tool_job_failure(generation, "Cosmic interference during generation")
+    if failure is None:
+        response_text = generation.result().strip()
+
+        # Extract JSON from markdown block
+        if response_text.startswith("```json"):
+            response_text = response_text[len("```json"):].strip()
+        if response_text.endswith("```"):
+            response_text = response_text[:-len("```")].strip()
+
+        # Parse the JSON response
+        try:
+            st.session_state.generated_app_files = json.loads(response_text)
+            return
+        except Exception as e:
+            failure = f"Cosmic interference during generation: {e}"
+    st.session_state.tool_notices["Genesis Engine"] = (failure, generation.text)
+
+def finish_data_storyteller(generations):
+    """Store the Data Storyteller's report, partial if it was cut short."""
+    st.session_state.data_story_report = tool_job_text(generations['report'], "The data's story could not be told")
+
+def finish_multiverse_modeler(generations):
+    """Store the Multiverse Modeler's report, partial if it was cut short."""
+    st.session_state.multiverse_report = tool_job_text(generations['report'], "A temporal paradox occurred")
+
+def finish_oneiros(generations):
+    """Turn the Oneiros Project's image, story and sound generations into the woven dream."""
+    output = {}
+    image = generations['image']
+    if not image.cancelled() and image.exception() is None:
+        image_bytes, _ = parse_art_response(image.result())
+        if image_bytes:
+            output['image'] = image_bytes
+
+    story_text = tool_job_text(generations['story'], "The story could not be told")
+    if story_text:
+        output['story'] = story_text
+
+    sound = generations['sound']
+    failure = tool_job_failure(sound, "The soundscape could not be composed")
+    if failure is not None:
+        output['audio_error'] = failure
+    else:
+        try:
+            symphony_response_text = sound.result().strip().replace("```json", "").replace("```", "")
+            symphony_data = json.loads(symphony_response_text)
+            code_to_run = symphony_data.get("code", "")
+
+            if code_to_run:
+                local_scope = {'np': np, 'io': io, 'wavfile': wavfile, 'signal': signal}
+                exec(code_to_run, local_scope)
+                if 'wav_buffer' in local_scope:
+                    output['audio'] = local_scope['wav_buffer'].getvalue()
+                else:
+                    output['audio_error'] = "The generated code did not produce a 'wav_buffer'."
+            else:
+                output['audio_error'] = "The AI did not generate any code for the soundscape."
+        except Exception as e:
+            output['audio_error'] = f"An error occurred while weaving the dream: {e}"
+    st.session_state.oneiros_output = output
+
+def submit_session_task(task, session_id):
+    """Run `task(session_id)` in the background unless it is still running for that session."""
+    key = (task.__name__, session_id)
+    running = st.session_state.session_tasks.get(key)
+    if running is None or running.done():
+        st.session_state.session_tasks[key] = submit_background_task(task, session_id)
 
 # Initialize session state
+if "user_id" not in st.session_state:
+    st.session_state.user_id = uuid.uuid4().hex # Identifies this browser session in the model call queue
 if "current_session_id" not in st.session_state:
     st.session_state.current_session_id = None
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "messages_cursor" not in st.session_state:
+    st.session_state.messages_cursor = None
+if "message_window" not in st.session_state:
+    st.session_state.message_window = MESSAGE_PAGE_SIZE
+if "history_page" not in st.session_state:
+    st.session_state.history_page = 0
+if "pending_suggestions" not in st.session_state:
+    st.session_state.pending_suggestions = {} # Assistant message timestamp -> future of its suggestions
+if "session_tasks" not in st.session_state:
+    st.session_state.session_tasks = {} # (task name, session ID) -> future of the latest background run
 if "audio_to_play" not in st.session_state:
     st.session_state.audio_to_play = None
 if "dataframe_for_viz" not in st.session_state:
@@ -991,8 +1519,6 @@ if "selected_persona" not in st.session_state:
     st.session_state.selected_persona = "Cosmic Intelligence"
 if "ethical_analysis_request" not in st.session_state:
     st.session_state.ethical_analysis_request = None
-if "symphony_to_play" not in st.session_state:
-    st.session_state.symphony_to_play = None
 if "alchemist_code" not in st.session_state:
     st.session_state.alchemist_code = None
 if "alchemist_explanation" not in st.session_state:
@@ -1013,10 +1539,17 @@ if "doc_oracle_summary" not in st.session_state:
     st.session_state.doc_oracle_summary = None
 if "doc_oracle_qa" not in st.session_state:
     st.session_state.doc_oracle_qa = []
-if "doc_oracle_docs" not in st.session_state:
-    st.session_state.doc_oracle_docs = None
+if "doc_oracle_index" not in st.session_state:
+    st.session_state.doc_oracle_index = None
 if "data_story_report" not in st.session_state:
     st.session_state.data_story_report = None
+if "tool_jobs" not in st.session_state:
+    st.session_state.tool_jobs = {} # Tool name -> {generation name: Generation} of its running job
+if "tool_notices" not in st.session_state:
+    st.session_state.tool_notices = {} # Tool name -> (message, partial output) when its last job left no result
+
+# Model calls made by this run queue as this user's; chat replies and background work override the priority
+set_caller(st.session_state.user_id)
 
 # Main content area
 st.markdown("<br>", unsafe_allow_html=True)
@@ -1035,6 +1568,7 @@ st.markdown("""
 # Sidebar with chat interface
 with st.sidebar:
     st.markdown("### 🌌 CHAT SESSIONS")
+    show_model_queue()
     
     # New chat button
     col1, col2 = st.columns([3, 1])
@@ -1043,6 +1577,8 @@ with st.sidebar:
             new_session_id = create_new_session(db, persona_name=st.session_state.selected_persona)
             st.session_state.current_session_id = new_session_id
             st.session_state.messages = []
+            st.session_state.messages_cursor = None
+            st.session_state.message_window = MESSAGE_PAGE_SIZE
             st.session_state.show_chat_export = False
             st.rerun()
     
@@ -1051,34 +1587,44 @@ with st.sidebar:
             st.rerun()
     
     # Search bar
-    search_query = st.text_input("🔍 Search history...", placeholder="Filter by name...")
+    search_query = st.text_input("🔍 Search history...", placeholder="Search names and messages...")
 
-    # Load existing sessions
-    sessions = get_all_sessions(db)
+    # Load existing sessions (metadata only, one page at a time)
     if search_query:
-        sessions = [s for s in sessions if search_query.lower() in s.get('session_name', '').lower()]
+        sessions = search_sessions(db, search_query, limit=HISTORY_PAGE_SIZE)
+        total_sessions = len(sessions)
+    else:
+        total_sessions = count_sessions(db)
+        max_history_page = max(0, (total_sessions - 1) // HISTORY_PAGE_SIZE)
+        st.session_state.history_page = min(st.session_state.history_page, max_history_page)
+        sessions = get_sessions_page(db, limit=HISTORY_PAGE_SIZE, offset=st.session_state.history_page * HISTORY_PAGE_SIZE)
     
     if sessions:
         st.markdown("---")
         st.markdown("#### HISTORY")
         
-        for session in sessions[:10]:
-            session_id = session.doc_id
+        for session in sessions:
+            session_id = session['doc_id']
             session_name = session.get('session_name', 'Unnamed Chat')
             
             col1, col2 = st.columns([4, 1])
             
             with col1:
+                branch_note = f" · branch of {get_session_name(db, session['parent_session_id'])}" if session['parent_session_id'] else ""
                 if st.button(
-                    f" {session_name}",
+                    f"{'🌿' if session['parent_session_id'] else ''} {session_name}",
                     key=f"load_{session_id}",
-                    use_container_width=True
+                    use_container_width=True,
+                    help=f"{session['message_count']} messages · last active {session['last_activity'][:16].replace('T', ' ')}" + branch_note + (" · archived" if session['archived_at'] else "")
                 ):
                     st.session_state.current_session_id = session_id
-                    st.session_state.messages = load_session_messages(db, session_id)
+                    st.session_state.messages, st.session_state.messages_cursor = load_session_messages_page(db, session_id, limit=MESSAGE_PAGE_SIZE)
+                    st.session_state.message_window = MESSAGE_PAGE_SIZE
                     st.session_state.selected_persona = get_session_persona(db, session_id) # Update selector state
                     st.session_state.show_chat_export = False
                     st.rerun()
+                if session.get('snippet'):
+                    st.caption(session['snippet'])
             
             with col2:
                 if st.button("🗑️", key=f"delete_{session_id}"):
@@ -1086,6 +1632,20 @@ with st.sidebar:
                     if st.session_state.current_session_id == session_id:
                         st.session_state.current_session_id = None
                         st.session_state.messages = []
+                        st.session_state.messages_cursor = None
+                    st.rerun()
+
+        if not search_query and total_sessions > HISTORY_PAGE_SIZE:
+            prev_col, page_col, next_col = st.columns([1, 2, 1])
+            with prev_col:
+                if st.button("◀", key="history_prev", use_container_width=True, disabled=st.session_state.history_page == 0):
+                    st.session_state.history_page -= 1
+                    st.rerun()
+            with page_col:
+                st.caption(f"Page {st.session_state.history_page + 1} of {max_history_page + 1}")
+            with next_col:
+                if st.button("▶", key="history_next", use_container_width=True, disabled=st.session_state.history_page >= max_history_page):
+                    st.session_state.history_page += 1
                     st.rerun()
     
     # --- Active Session Controls ---
@@ -1112,9 +1672,7 @@ with st.sidebar:
             st.session_state.show_chat_export = not st.session_state.show_chat_export
         
         if st.session_state.get('show_chat_export', False):
-            markdown_export = format_chat_as_markdown(st.session_state.messages, current_name)
-            safe_filename = "".join(c for c in current_name if c.isalnum() or c in (' ', '_')).rstrip().replace(' ', '_')
-            display_export_buttons(markdown_export, safe_filename)
+            display_chat_export_buttons(db, st.session_state.current_session_id, current_name)
 
     st.markdown("---")
     # --- Operating Mode Selection ---
@@ -1158,6 +1716,10 @@ with st.sidebar:
             options=TOOL_OPTIONS,
             label_visibility="collapsed"
         )
+        st.number_input(
+            "⏱️ Deadline (seconds)", min_value=30, max_value=1800, value=TOOL_DEADLINE_SECONDS, step=30, key="tool_deadline",
+            help="Genesis Engine, Data Storyteller, Multiverse Modeler and Oneiros stop waiting for the model after this long."
+        )
 
         if selected_tool == "🚀 Genesis Engine":
             st.markdown("<small>Describe a web tool or dashboard. The AI will generate a complete Streamlit app script for you to download.</small>", unsafe_allow_html=True)
@@ -1168,10 +1730,10 @@ with st.sidebar:
                 key="genesis_input"
             )
 
-            if st.button("✨ Generate App Script", key="genesis_button", use_container_width=True):
+            genesis_running = "Genesis Engine" in st.session_state.tool_jobs
+            if st.button("✨ Generate App Script", key="genesis_button", use_container_width=True, disabled=genesis_running):
                 if app_description:
-                    with st.spinner("🛠️ Architecting your application... Please wait."):
-                        GENESIS_ENGINE_PROMPT = f"""
+                    GENESIS_ENGINE_PROMPT = f"""
 You are the Genesis Engine, an expert AI software architect specializing in creating self-contained, multi-file Streamlit applications.
 Your task is to take a user's description of a web tool or dashboard and generate all the necessary files, packaged as a JSON object.
 
@@ -1198,33 +1760,20 @@ Your task is to take a user's description of a web tool or dashboard and generat
 **User's Request:**
 {app_description}
 """
-                        try:
-                            response = model.generate_content(GENESIS_ENGINE_PROMPT)
-                            response_text = response.text.strip()
-
-                            # Extract JSON from markdown block
-                            if response_text.startswith("```json"):
-                                response_text = response_text[len("```json"):].strip()
-                            if response_text.endswith("```"):
-                                response_text = response_text[:-len("```")].strip()
-                            
-                            # Parse the JSON response
-                            generated_files = json.loads(response_text)
-                            st.session_state.generated_app_files = generated_files
-                            
-                            safe_name = "".join(c for c in app_description if c.isalnum() or c == ' ').strip()
-                            safe_name = safe_name.replace(' ', '_').lower()
-                            if not safe_name:
-                                safe_name = 'generated_app'
-                            st.session_state.generated_app_name = f"{safe_name[:40]}.zip"
-
-                        except Exception as e:
-                            st.error(f"Cosmic interference during generation: {e}")
-                            if 'generated_app_files' in st.session_state:
-                                del st.session_state.generated_app_files
+                    st.session_state.pop("generated_app_files", None)
+                    safe_name = "".join(c for c in app_description if c.isalnum() or c == ' ').strip()
+                    safe_name = safe_name.replace(' ', '_').lower()
+                    if not safe_name:
+                        safe_name = 'generated_app'
+                    st.session_state.generated_app_name = f"{safe_name[:40]}.zip"
+                    start_tool_job("Genesis Engine", {'files': (GENESIS_ENGINE_PROMPT, {})})
+                    st.rerun()
                 else:
                     st.warning("Please describe the app you want to build.")
 
+            watch_tool_job("Genesis Engine", "🛠️ Architecting your application...", finish_genesis_engine)
+            show_tool_notice("Genesis Engine")
+
             # Display download button if files have been generated
             if "generated_app_files" in st.session_state and st.session_state.generated_app_files:
                 st.success("✅ Your app files are ready!")
@@ -1304,7 +1853,7 @@ Your task is to take a block of code and a user's instruction, then rewrite the
 
 Begin your work now."""
                             try:
-                                response = model.generate_content(CODE_ALCHEMIST_PROMPT)
+                                response = model_client.generate(CODE_ALCHEMIST_PROMPT)
                                 response_text = response.text.strip().replace("```json", "").replace("```", "")
                                 alchemist_result = json.loads(response_text)
                                 st.session_state.alchemist_code = alchemist_result.get("new_code", st.session_state.alchemist_code)
@@ -1334,41 +1883,50 @@ Begin your work now."""
                 if oracle_files:
                     st.session_state.doc_oracle_summary = None
                     st.session_state.doc_oracle_qa = []
-                    st.session_state.doc_oracle_docs = None
+                    st.session_state.doc_oracle_index = None
                     
+                    library = get_document_library()
                     with st.spinner("📚 Extracting knowledge from documents..."):
                         doc_texts = []
+                        doc_keys = []
                         for doc in oracle_files:
-                            text, content_type = process_uploaded_file(doc)
-                            if content_type == "text":
-                                doc_texts.append(f"--- Content from {doc.name} ---\n{text}")
-                            else:
-                                st.warning(f"Could not process {doc.name}: {text}")
-                        
-                        if doc_texts:
-                            full_text = "\n\n".join(doc_texts)
-                            st.session_state.doc_oracle_docs = full_text
-
-                            SUMMARY_PROMPT = f"""
-You are a "Document Oracle," an AI expert in synthesizing information.
-Your task is to read the following document(s) and provide a comprehensive, structured summary.
-
-**INSTRUCTIONS:**
-1.  **Identify Key Themes:** Determine the main topics, arguments, and conclusions.
-2.  **Create a Structured Summary:** Organize the summary with clear headings and bullet points.
-3.  **Extract Actionable Insights:** Pull out key takeaways, recommendations, or data points.
-4.  **Output Format:** Your response should be in Markdown.
-
-**Document Content:**
-{full_text}
-
-Begin your summary.
-"""
+                            # Documents seen before, in any session, are read back from the library
+                            key = content_hash(doc.getvalue())
+                            pages = library.get_pages(key)
+                            if pages is None:
+                                if Path(doc.name).suffix.lower() == '.pdf':
+                                    try:
+                                        doc.seek(0)
+                                        pages = extract_pages_from_pdf(doc)
+                                    except Exception as e:
+                                        st.warning(f"Could not process {doc.name}: Error reading PDF: {e}")
+                                        continue
+                                else:
+                                    text, content_type = process_uploaded_file(doc)
+                                    if content_type != "text":
+                                        st.warning(f"Could not process {doc.name}: {text}")
+                                        continue
+                                    pages = [text]
+                                library.add_document(key, doc.name, pages)
+                            doc_texts.append((doc.name, "\n\n".join(pages).strip()))
+                            doc_keys.append((doc.name, key))
+
+                    if doc_keys:
+                        # Questions are answered from the most relevant chunks, not the full text
+                        st.session_state.doc_oracle_index = get_document_index(tuple(doc_keys))
+
+                        library_key = summary_key([key for _, key in doc_keys])
+                        summary = library.get_summary(library_key)
+                        if summary is None:
+                            progress = st.progress(0.0, text="📚 Summarizing documents...")
+                            def show_progress(done, total):
+                                progress.progress(done / total, text=f"📚 Summarized {done} of {total} sections...")
                             try:
-                                response = model.generate_content(SUMMARY_PROMPT)
-                                st.session_state.doc_oracle_summary = response.text
+                                summary = summarize_documents(doc_texts, on_progress=show_progress)
+                                library.put_summary(library_key, summary)
                             except Exception as e:
-                                st.session_state.doc_oracle_summary = f"An error occurred during summarization: {e}"
+                                summary = f"An error occurred during summarization: {e}"
+                        st.session_state.doc_oracle_summary = summary
                 st.rerun()
 
             if st.session_state.get("doc_oracle_summary"):
@@ -1385,27 +1943,32 @@ Begin your summary.
                         st.markdown(qa['q'])
                     with st.chat_message("assistant", avatar="🗣️"):
                         st.markdown(qa['a'])
+                        if qa.get('sources'):
+                            st.caption("📎 Sources: " + " · ".join(qa['sources']))
 
                 question = st.text_input("Ask a specific question about the documents:", key="doc_oracle_question", label_visibility="collapsed", placeholder="Ask a specific question...")
 
                 if st.button("💬 Ask Oracle", key="doc_oracle_ask", use_container_width=True):
-                    if question and st.session_state.get("doc_oracle_docs"):
+                    if question and st.session_state.get("doc_oracle_index"):
                         with st.spinner("Consulting the oracle..."):
+                            excerpts = st.session_state.doc_oracle_index.search(question, top_k=DOC_ORACLE_TOP_K)
                             QA_PROMPT = f"""
 You are a "Document Oracle." You have already read the documents.
-Answer the user's question based *only* on the information within these documents.
-If the answer is not in the documents, state that clearly.
+Answer the user's question based *only* on the numbered excerpts below, which are the passages of the documents most relevant to it.
+Cite the excerpts you use inline as [1], [2], etc.
+If the answer is not in the excerpts, state that clearly.
 
-**Full Document Content:**
-{st.session_state.doc_oracle_docs}
+**Relevant Excerpts:**
+{format_excerpts(excerpts) if excerpts else "(No passage of the documents matches this question.)"}
 ---
 **User's Question:** "{question}"
 
 Provide your answer."""
                             try:
-                                response = model.generate_content(QA_PROMPT)
+                                response = model_client.generate(QA_PROMPT)
                                 answer = response.text
-                                st.session_state.doc_oracle_qa.append({'q': question, 'a': answer})
+                                sources = [f"[{number}] {citation(chunk)}" for number, (chunk, _) in enumerate(excerpts, start=1)]
+                                st.session_state.doc_oracle_qa.append({'q': question, 'a': answer, 'sources': sources})
                             except Exception as e:
                                 st.error(f"The oracle could not answer: {e}")
                         st.rerun()
@@ -1416,7 +1979,7 @@ Provide your answer."""
                 if st.button("Clear Oracle Session", key="clear_doc_oracle", use_container_width=True):
                     st.session_state.doc_oracle_summary = None
                     st.session_state.doc_oracle_qa = []
-                    st.session_state.doc_oracle_docs = None
+                    st.session_state.doc_oracle_index = None
                     st.rerun()
 
         elif selected_tool == "📊 Data Storyteller":
@@ -1425,10 +1988,11 @@ Provide your answer."""
             data_story_file = st.file_uploader("Upload your dataset (CSV, XLS, XLSX)", type=['csv', 'xls', 'xlsx'], key="data_story_uploader")
             story_focus = st.text_input("What should the story focus on? (Optional)", placeholder="e.g., 'Analyze sales performance by region.'", key="data_story_focus")
 
-            if st.button("📖 Tell Me a Story", key="data_story_button", use_container_width=True, disabled=not data_story_file):
+            story_running = "Data Storyteller" in st.session_state.tool_jobs
+            if st.button("📖 Tell Me a Story", key="data_story_button", use_container_width=True, disabled=not data_story_file or story_running):
                 if data_story_file:
                     st.session_state.data_story_report = None
-                    with st.spinner("✍️ Weaving a story from your data..."):
+                    with st.spinner("✍️ Reading your data..."):
                         try:
                             data_story_file.seek(0)
                             df = pd.read_csv(data_story_file) if Path(data_story_file.name).suffix.lower() == '.csv' else pd.read_excel(data_story_file)
@@ -1454,12 +2018,13 @@ Provide your answer."""
 **Dataset Summary:**\n{data_summary}
 ---
 Begin your data story."""
-                            response = model.generate_content(STORYTELLER_PROMPT)
-                            st.session_state.data_story_report = response.text
+                            start_tool_job("Data Storyteller", {'report': (STORYTELLER_PROMPT, {})})
                         except Exception as e:
                             st.session_state.data_story_report = f"The data's story could not be told: {e}"
                 st.rerun()
 
+            watch_tool_job("Data Storyteller", "✍️ Weaving a story from your data...", finish_data_storyteller, preview='report')
+
             if st.session_state.get("data_story_report"):
                 st.markdown("---"); st.markdown("#### 📊 Your Data Story")
                 content = st.session_state.data_story_report
@@ -1497,10 +2062,11 @@ Begin your data story."""
                 key="multiverse_divergence_input"
             )
 
-            if st.button("🌌 Model Alternate Timeline", key="multiverse_button", use_container_width=True):
+            multiverse_running = "Multiverse Modeler" in st.session_state.tool_jobs
+            if st.button("🌌 Model Alternate Timeline", key="multiverse_button", use_container_width=True, disabled=multiverse_running):
                 if historical_event and divergence_point:
-                    with st.spinner("⏳ Calculating temporal probabilities..."):
-                        MULTIVERSE_MODELER_PROMPT = f"""
+                    st.session_state.multiverse_report = None
+                    MULTIVERSE_MODELER_PROMPT = f"""
 You are the "Multiverse Modeler," a historian from a higher dimension with access to the Akashic records of all possible timelines.
 Your task is to analyze a pivotal historical event and a user-specified "point of divergence" to construct a plausible alternate history.
 
@@ -1527,14 +2093,13 @@ Your task is to analyze a pivotal historical event and a user-specified "point o
 
 Begin your temporal analysis now.
 """
-                        try:
-                            response = model.generate_content(MULTIVERSE_MODELER_PROMPT)
-                            st.session_state.multiverse_report = response.text
-                        except Exception as e:
-                            st.session_state.multiverse_report = f"A temporal paradox occurred: {e}"
+                    start_tool_job("Multiverse Modeler", {'report': (MULTIVERSE_MODELER_PROMPT, {})})
+                    st.rerun()
                 else:
                     st.warning("Please provide both a historical event and a point of divergence.")
 
+            watch_tool_job("Multiverse Modeler", "⏳ Calculating temporal probabilities...", finish_multiverse_modeler, preview='report')
+
             if "multiverse_report" in st.session_state and st.session_state.multiverse_report:
                 st.markdown("---")
                 st.markdown(st.session_state.multiverse_report)
@@ -1555,24 +2120,13 @@ Begin your temporal analysis now.
                 key="oneiros_input"
             )
 
-            if st.button("🕸️ Weave the Dream", key="oneiros_button", use_container_width=True):
+            oneiros_running = "Oneiros Project" in st.session_state.tool_jobs
+            if st.button("🕸️ Weave the Dream", key="oneiros_button", use_container_width=True, disabled=oneiros_running):
                 if dream_input:
-                    st.session_state.oneiros_output = {} # Reset previous output
-                    with st.spinner("Translating the subconscious... (This may take a moment)"):
-                        try:
-                            # Step 1: Generate Image
-                            image_prompt = f"A surreal, dream-like, abstract visualization of the feeling of '{dream_input}'. Highly detailed, atmospheric, digital art."
-                            image_bytes, _ = generate_art_from_text(image_prompt)
-                            if image_bytes:
-                                st.session_state.oneiros_output['image'] = base64.b64encode(image_bytes).decode('utf-8')
-
-                            # Step 2: Generate Story
-                            story_prompt = f"You are a surrealist poet. Write a short, abstract, dream-like story or poem about the feeling of '{dream_input}'. Evoke emotion through metaphor and strange imagery, not direct explanation."
-                            story_text = get_cosmic_response(story_prompt, "You are a surrealist poet.")
-                            st.session_state.oneiros_output['story'] = story_text
-
-                            # Step 3: Generate Audio
-                            sonification_prompt = f"""You are a sound artist who creates ambient, dream-like soundscapes from abstract concepts.
+                    st.session_state.oneiros_output = None # Reset previous output
+                    image_prompt = f"A surreal, dream-like, abstract visualization of the feeling of '{dream_input}'. Highly detailed, atmospheric, digital art."
+                    story_prompt = f"You are a surrealist poet. Write a short, abstract, dream-like story or poem about the feeling of '{dream_input}'. Evoke emotion through metaphor and strange imagery, not direct explanation."
+                    sonification_prompt = f"""You are a sound artist who creates ambient, dream-like soundscapes from abstract concepts.
 Your task is to generate Python code that sonifies the feeling of '{dream_input}'.
 
 **INSTRUCTIONS:**
@@ -1590,36 +2144,26 @@ Your task is to generate Python code that sonifies the feeling of '{dream_input}
 }}
 ```
 Begin your composition now."""
-                            
-                            symphony_response = get_cosmic_response(sonification_prompt, "You are a sound artist.")
-                            symphony_response_text = symphony_response.strip().replace("```json", "").replace("```", "")
-                            symphony_data = json.loads(symphony_response_text)
-                            code_to_run = symphony_data.get("code", "")
-
-                            if code_to_run:
-                                local_scope = {'np': np, 'io': io, 'wavfile': wavfile, 'signal': signal}
-                                exec(code_to_run, local_scope)
-                                if 'wav_buffer' in local_scope:
-                                    st.session_state.oneiros_output['audio'] = local_scope['wav_buffer'].getvalue()
-                                else:
-                                    st.session_state.oneiros_output['audio_error'] = "The generated code did not produce a 'wav_buffer'."
-                            else:
-                                st.session_state.oneiros_output['audio_error'] = "The AI did not generate any code for the soundscape."
 
-                        except Exception as e:
-                            st.error(f"An error occurred while weaving the dream: {e}")
-                            st.session_state.oneiros_output = None # Clear partial results on error
+                    # Image, story and sound are generated concurrently
+                    start_tool_job("Oneiros Project", {
+                        'image': (art_request(image_prompt), {'model_name': IMAGE_MODEL, 'use_cache': False, 'stream': False}),
+                        'story': (build_cosmic_request(story_prompt, "You are a surrealist poet."), {}),
+                        'sound': (build_cosmic_request(sonification_prompt, "You are a sound artist."), {})
+                    })
+                    st.rerun()
                 else:
                     st.warning("Please describe a dream or feeling to begin.")
 
+            watch_tool_job("Oneiros Project", "Translating the subconscious...", finish_oneiros, preview='story')
+
             if st.session_state.get("oneiros_output"):
                 st.markdown("---")
                 st.markdown("#### The Woven Dream")
                 output = st.session_state.oneiros_output
 
                 if 'image' in output:
-                    image_bytes = base64.b64decode(output['image'])
-                    st.image(image_bytes, caption="A vision from the subconscious.", use_container_width=True)
+                    st.image(output['image'], caption="A vision from the subconscious.", use_container_width=True)
                 
                 if 'story' in output:
                     st.markdown("##### A Story from the Ether")
@@ -1667,7 +2211,7 @@ Your task is to take a set of keywords and forge them into a short, compelling m
 Begin your tale.
 """
                         try:
-                            response = model.generate_content(MYTHOS_FORGE_PROMPT)
+                            response = model_client.generate(MYTHOS_FORGE_PROMPT)
                             st.session_state.mythos_output = response.text
                         except Exception as e:
                             st.session_state.mythos_output = f"A thread of the story was lost: {e}"
@@ -1722,7 +2266,7 @@ Your task is to convert a user's high-level description of a personality into a
 Now, generate the complete AI persona instruction prompt.
 '''
                         try:
-                            response = model.generate_content(PERSONA_CRAFTER_PROMPT)
+                            response = model_client.generate(PERSONA_CRAFTER_PROMPT)
                             st.session_state.persona_crafter_output = response.text
                         except Exception as e:
                             st.session_state.persona_crafter_output = f"The persona's creation was flawed: {e}"
@@ -1818,7 +2362,7 @@ Your task is to cross-reference a research paper with a dataset to generate nove
 ---
 
 Begin your analysis now."""
-                        response = model.generate_content(HYPOTHESIS_ENGINE_PROMPT)
+                        response = model_client.generate(HYPOTHESIS_ENGINE_PROMPT)
                         analysis_report = response.text
                     except Exception as e:
                         analysis_report = f"🔬 Cosmic interference during hypothesis generation: {e}"
@@ -1945,7 +2489,7 @@ Summary of `df`:
 ```
 Begin your composition now."""
                     
-                    response = model.generate_content(COSMIC_SYMPHONY_PROMPT)
+                    response = model_client.generate(COSMIC_SYMPHONY_PROMPT)
                     response_text = response.text.strip().replace("```json", "").replace("```", "")
                     
                     symphony_data = json.loads(response_text)
@@ -1960,8 +2504,8 @@ Begin your composition now."""
                         exec(code_to_run, local_scope)
                         
                         if 'wav_buffer' in local_scope:
-                            st.session_state.symphony_to_play = local_scope['wav_buffer']
-                            assistant_message = save_message(db, st.session_state.current_session_id, "assistant", description)
+                            symphony_content = make_media_message('audio', local_scope['wav_buffer'].getvalue(), description)
+                            assistant_message = save_message(db, st.session_state.current_session_id, "assistant", symphony_content)
                             if assistant_message: st.session_state.messages.append(assistant_message)
                         else: raise ValueError("The generated code did not produce a 'wav_buffer'.")
                     else: raise ValueError("The AI did not generate any code for the symphony.")
@@ -2149,21 +2693,35 @@ apply_cosmic_theme(fig, 'Supernova')
 
     st.markdown("---")
     
-    # Display chat messages
-    for message in st.session_state.messages:
+    # Display chat messages (only the newest window is rendered; older pages load on demand)
+    if len(st.session_state.messages) > st.session_state.message_window or st.session_state.messages_cursor:
+        if st.button("⬆️ Load older messages", key="load_older_messages", use_container_width=True):
+            st.session_state.message_window += MESSAGE_PAGE_SIZE
+            if len(st.session_state.messages) < st.session_state.message_window and st.session_state.messages_cursor:
+                older_messages, st.session_state.messages_cursor = load_session_messages_page(
+                    db, st.session_state.current_session_id, limit=MESSAGE_PAGE_SIZE, before=st.session_state.messages_cursor
+                )
+                st.session_state.messages = older_messages + st.session_state.messages
+            st.rerun()
+
+    window_start = max(0, len(st.session_state.messages) - st.session_state.message_window)
+    for message_index, message in enumerate(st.session_state.messages[window_start:], start=window_start):
         avatar = "🌌" if message["role"] == "assistant" else "🧑‍🚀"
         with st.chat_message(message["role"], avatar=avatar):
             content = message.get('content', '')
-            is_image_message = content.startswith("[IMAGE:") and "]" in content
+            media = parse_media_message(content)
+            is_image_message = media is not None and media[0] == 'image'
+            is_audio_message = media is not None and media[0] == 'audio'
 
             if message["role"] == "assistant" and "Ethical Compass Report" not in content:
                 col1, col2, col3 = st.columns([12, 1, 1])
                 with col1:
                     if is_image_message:
                         try:
-                            header, description = content.split("]", 1)
-                            image_base64 = header.replace("[IMAGE:", "")
-                            image_bytes = base64.b64decode(image_base64)
+                            _, media_ref, description = media
+                            image_bytes = load_media(media_ref)
+                            if image_bytes is None:
+                                raise FileNotFoundError("the image is missing from the media store")
                             img = Image.open(io.BytesIO(image_bytes))
 
                             st.image(img, caption="✨ Generated Masterpiece", use_container_width=True)
@@ -2196,6 +2754,15 @@ apply_cosmic_theme(fig, 'Supernova')
                         except Exception as e:
                             st.error(f"Error displaying generated image: {e}")
                             st.markdown(content) # Fallback to show raw content
+                    elif is_audio_message:
+                        _, media_ref, description = media
+                        if description:
+                            st.markdown(description)
+                        audio_bytes = load_media(media_ref)
+                        if audio_bytes:
+                            st.audio(audio_bytes, format='audio/wav')
+                        else:
+                            st.warning("This soundscape is missing from the media store.")
                     else:
                         parts = content.split('```')
                         for i, part in enumerate(parts):
@@ -2232,7 +2799,7 @@ apply_cosmic_theme(fig, 'Supernova')
                             else:
                                 st.markdown(part)
                 with col2:
-                    if not is_image_message:
+                    if media is None:
                         if st.button("🔊", key=f"play_{message['timestamp']}", help="Read aloud"):
                             st.session_state.audio_to_play = content
                             st.rerun()
@@ -2246,6 +2813,18 @@ apply_cosmic_theme(fig, 'Supernova')
             else:
                 is_ethics_report = "Ethical Compass Report" in content
                 st.markdown(content)
+                if message["role"] == "user" and st.session_state.current_session_id:
+                    if st.button("🌿", key=f"branch_{message['timestamp']}", help="Branch from here: re-ask this question in a new chat that shares the conversation so far"):
+                        # Position of this message in the full history (older pages may not be loaded)
+                        message_offset = count_session_messages(db, st.session_state.current_session_id) - (len(st.session_state.messages) - message_index)
+                        branch_id = fork_session(db, st.session_state.current_session_id, message_offset)
+                        if branch_id:
+                            st.session_state.current_session_id = branch_id
+                            st.session_state.messages, st.session_state.messages_cursor = load_session_messages_page(db, branch_id, limit=MESSAGE_PAGE_SIZE)
+                            st.session_state.message_window = MESSAGE_PAGE_SIZE
+                            st.session_state.show_chat_export = False
+                            st.session_state.chat_input = content # Pick a new mode, then send to re-ask
+                        st.rerun()
                 if message["role"] == "assistant" and is_ethics_report:
                     st.markdown("---")
                     safe_ts = message['timestamp'].replace(':', '-').replace('.', '-')
@@ -2267,6 +2846,12 @@ apply_cosmic_theme(fig, 'Supernova')
                 for file_name in message["files"]:
                     st.caption(f"📎 {file_name}")
     
+    if st.session_state.pending_suggestions:
+        poll_pending_suggestions()
+
+    # The turn being sent is rendered here, under the transcript, while the reply streams in
+    live_turn = st.container()
+
     # Chat input
     if st.session_state.get('canvas_mode', False):
         st.info("🎨 **Canvas Mode is active.** All prompts will generate images.")
@@ -2369,56 +2954,60 @@ apply_cosmic_theme(fig, 'Supernova')
                         gemini_parts.append(f"--- Image: {uploaded_file.name} ---")
                         gemini_parts.append(content)
         
-        user_message = save_message(
-            db,
-            st.session_state.current_session_id,
-            "user",
-            prompt,
-            file_names if file_names else None
-        )
-        if user_message:
-            st.session_state.messages.append(user_message)
+        # Persist the whole turn (user message, persona evolution, reply) as one atomic write. Its
+        # messages join the transcript only once that write commits, so a failed or stopped turn leaves no trace.
+        turn_messages = []
+        with unit_of_work(db):
+            user_message = save_message(
+                db,
+                st.session_state.current_session_id,
+                "user",
+                prompt,
+                file_names if file_names else None
+            )
+            if user_message:
+                turn_messages.append(user_message)
         
-        if st.session_state.get('canvas_mode', False):
-            with st.spinner("🎨 Conjuring a cosmic masterpiece..."):
-                image_bytes, description = generate_art_from_text(prompt, negative_prompt)
-                if image_bytes:
-                    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-                    content_to_save = f"[IMAGE:{image_base64}]{description}"
-                    assistant_message = save_message(db, st.session_state.current_session_id, "assistant", content_to_save)
+            if st.session_state.get('canvas_mode', False):
+                with st.spinner("🎨 Conjuring a cosmic masterpiece..."):
+                    image_bytes, description = generate_art_from_text(prompt, negative_prompt)
+                    if image_bytes:
+                        content_to_save = make_media_message('image', image_bytes, description)
+                        assistant_message = save_message(db, st.session_state.current_session_id, "assistant", content_to_save)
+                    else:
+                        assistant_message = save_message(db, st.session_state.current_session_id, "assistant", description) # description contains error
+                    if assistant_message:
+                        turn_messages.append(assistant_message)
+            else:
+                session_persona_name = get_session_persona(db, st.session_state.current_session_id)
+                if session_persona_name == "Cognitive Twin":
+                    # The persona evolves in the background after the turn (see below), so the reply costs one model call
+                    cosmic_context = cognitive_twin_context(get_session_persona_description(db, st.session_state.current_session_id))
                 else:
-                    assistant_message = save_message(db, st.session_state.current_session_id, "assistant", description) # description contains error
+                    cosmic_context = PERSONAS.get(session_persona_name, PERSONAS["Cosmic Intelligence"])
+                # Earlier turns (this prompt is not committed yet, so it is not part of the history)
+                history = build_conversation_history(db, st.session_state.current_session_id)
+                
+                with live_turn:
+                    with st.chat_message("user", avatar="🧑‍🚀"):
+                        st.markdown(prompt)
+                    with st.chat_message("assistant", avatar="🌌"):
+                        response = st.write_stream(stream_cosmic_response(prompt, cosmic_context, parts=gemini_parts, persona_name=session_persona_name, history=history))
+                assistant_message = save_message(db, st.session_state.current_session_id, "assistant", response)
                 if assistant_message:
-                    st.session_state.messages.append(assistant_message)
-        else:
-            session_persona_name = get_session_persona(db, st.session_state.current_session_id)
+                    turn_messages.append(assistant_message)
+        st.session_state.messages.extend(turn_messages)
+
+        # Suggestions are generated in the background once the reply is committed, so the turn never waits on them
+        if assistant_message and not st.session_state.get('canvas_mode', False):
+            st.session_state.pending_suggestions[assistant_message['timestamp']] = submit_background_task(
+                generate_and_save_suggestions, st.session_state.current_session_id, assistant_message['timestamp'], prompt, response
+            )
+            submit_session_task(update_conversation_summary, st.session_state.current_session_id)
             if session_persona_name == "Cognitive Twin":
-                with st.spinner("🧠 Cognitive Twin is evolving..."):
-                    all_session_messages = load_session_messages(db, st.session_state.current_session_id)
-                    user_messages_text = "\n".join([msg['content'] for msg in all_session_messages if msg['role'] == 'user'])
-                    user_messages_text += "\n" + prompt
-                    cosmic_context = generate_cognitive_twin_persona(user_messages_text)
-                    sessions_table = db.table('sessions')
-                    sessions_table.update({'dynamic_persona_description': cosmic_context}, doc_ids=[st.session_state.current_session_id])
-            else:
-                cosmic_context = PERSONAS.get(session_persona_name, PERSONAS["Cosmic Intelligence"])
-                
-            response = get_cosmic_response(prompt, cosmic_context, parts=gemini_parts)
-            suggestions = get_follow_up_suggestions(prompt, response)
-            assistant_message = save_message(db, st.session_state.current_session_id, "assistant", response, suggestions=suggestions)
-            if assistant_message:
-                st.session_state.messages.append(assistant_message)
-        
+                submit_session_task(evolve_cognitive_twin, st.session_state.current_session_id)
         st.rerun()
 
-    # --- COSMIC SYMPHONY PLAYER ---
-    if st.session_state.get('symphony_to_play'):
-        symphony_buffer = st.session_state.symphony_to_play
-        st.session_state.symphony_to_play = None # Clear the request to prevent re-playing
-
-        # Embed the audio player at the bottom of the screen
-        st.audio(symphony_buffer, format='audio/wav')
-
     # --- ETHICAL COMPASS ANALYSIS ---
     if st.session_state.get('ethical_analysis_request'):
         request = st.session_state.ethical_analysis_request
@@ -2447,10 +3036,11 @@ apply_cosmic_theme(fig, 'Supernova')
 
 Begin your ethical analysis report now."""
 
-            analysis_report = get_cosmic_response(
-                prompt="Perform ethical analysis on the provided content.",
-                cosmic_context=ETHICAL_COMPASS_PROMPT.format(response_content=response_content)
-            )
+            with caller_priority(PRIORITY_BACKGROUND):
+                analysis_report = get_cosmic_response(
+                    prompt="Perform ethical analysis on the provided content.",
+                    cosmic_context=ETHICAL_COMPASS_PROMPT.format(response_content=response_content)
+                )
 
             report_message = f"⚖️ **Ethical Compass Report** (Analysis of response at {datetime.fromisoformat(request['timestamp']).strftime('%H:%M:%S')}):\n\n{analysis_report}"
 
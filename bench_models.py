@@ -0,0 +1,144 @@
+"""Offline load test of the model pipeline (admission control, retries, streaming).
+
+Simulated users send a mix of streamed chat replies, tool generations and
+background calls through a ModelClient whose models are mock_model.MockModel,
+so no API key or network access is needed and runs with the same seed and
+settings are repeatable. Reports latency percentiles per kind of call
+(time to first chunk for streams), failures and throughput. Needs neither
+Streamlit nor the response cache.
+
+Usage:
+    python bench_models.py                                  # 20 users x 10 calls, default limits
+    python bench_models.py --users 100 --rate 600 --burst 50
+    python bench_models.py --latency 2 --error-rate 0.1     # slow, flaky model
+    python bench_models.py --json results.json              # also save raw numbers
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from mock_model import (
+    DEFAULT_CHUNK_DELAY_SECONDS, DEFAULT_ERROR_RATE, DEFAULT_LATENCY_SECONDS, MockModel
+)
+from model_client import (
+    DEFAULT_BURST, DEFAULT_MAX_CONCURRENT, DEFAULT_RATE_PER_MINUTE, PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE, PRIORITY_TOOL, ModelClient
+)
+
+# name: (priority, streamed, prompt template, share of calls)
+WORKLOADS = {
+    'chat': (PRIORITY_INTERACTIVE, True, "**User's Query:** {topic}", 0.5),
+    'tool': (PRIORITY_TOOL, False, 'You are a "Data Storyteller," {topic}', 0.2),
+    'background': (PRIORITY_BACKGROUND, False, 'User: "{topic}"\nReturn as JSON list of strings.', 0.3),
+}
+TOPICS = [
+    "How do black holes evaporate?", "What is dark matter made of?", "Why is the sky dark at night?",
+    "How do neutron stars form?", "What came before the Big Bang?", "Are wormholes possible?",
+]
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+async def timed_call(client, workload, user, rng):
+    """Make one call of a workload; returns (seconds to first chunk or answer, total seconds, error or None)."""
+    priority, streamed, template, _ = WORKLOADS[workload]
+    prompt = template.format(topic=f"{rng.choice(TOPICS)} (call {rng.randrange(10 ** 6)})")
+    start = time.perf_counter()
+    first = None
+    try:
+        if streamed:
+            async for _ in client.stream_async(prompt, user=user, priority=priority, use_cache=False):
+                if first is None:
+                    first = time.perf_counter() - start
+        else:
+            await client.generate_async(prompt, user=user, priority=priority, use_cache=False)
+    except Exception as e:
+        return first, time.perf_counter() - start, type(e).__name__
+    total = time.perf_counter() - start
+    return (first if first is not None else total), total, None
+
+async def simulate_user(client, user, calls, think_seconds, rng, results):
+    """One user making `calls` calls back to back, pausing up to `think_seconds` between them."""
+    names = list(WORKLOADS)
+    shares = [WORKLOADS[name][3] for name in names]
+    for _ in range(calls):
+        workload = rng.choices(names, weights=shares)[0]
+        first, total, error = await timed_call(client, workload, user, rng)
+        results.append({'workload': workload, 'user': user, 'first_seconds': first, 'total_seconds': total, 'error': error})
+        await asyncio.sleep(rng.uniform(0, think_seconds))
+
+async def run_load(client, args):
+    """Run every simulated user at once; returns the per-call results."""
+    results = []
+    await asyncio.gather(*(
+        simulate_user(client, f"user-{number}", args.calls, args.think, random.Random(f"{args.seed}:{number}"), results)
+        for number in range(args.users)
+    ))
+    return results
+
+def summarize(workload, results):
+    """Latency statistics (seconds) of one workload's successful calls."""
+    calls = [result for result in results if result['workload'] == workload]
+    done = [result for result in calls if result['error'] is None]
+    firsts = sorted(result['first_seconds'] for result in done)
+    totals = sorted(result['total_seconds'] for result in done)
+    summary = {'workload': workload, 'calls': len(calls), 'failed': len(calls) - len(done)}
+    if done:
+        summary.update({
+            'first_p50': percentile(firsts, 0.50), 'first_p95': percentile(firsts, 0.95),
+            'total_p50': percentile(totals, 0.50), 'total_p95': percentile(totals, 0.95),
+            'total_p99': percentile(totals, 0.99), 'total_max': totals[-1],
+        })
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--calls', type=int, default=10, help="Calls per user")
+    parser.add_argument('--think', type=float, default=1.0, help="Maximum pause between a user's calls (seconds)")
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE_PER_MINUTE, help="Admitted calls per minute")
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST)
+    parser.add_argument('--concurrent', type=int, default=DEFAULT_MAX_CONCURRENT)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY_SECONDS, help="Mock time to first chunk (seconds)")
+    parser.add_argument('--chunk-delay', type=float, default=DEFAULT_CHUNK_DELAY_SECONDS)
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_ERROR_RATE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Also write the summary and raw results to this file")
+    args = parser.parse_args()
+
+    backend = MockModel.factory(latency=args.latency, chunk_delay=args.chunk_delay,
+                                error_rate=args.error_rate, seed=args.seed)
+    client = ModelClient(rate_per_minute=args.rate, burst=args.burst, max_concurrent=args.concurrent, backend=backend)
+    print(f"{args.users} users x {args.calls} calls; limits {args.rate:g}/min, burst {args.burst}, "
+          f"{args.concurrent} in flight; mock latency {args.latency:g}s, error rate {args.error_rate:.0%}", flush=True)
+
+    start = time.perf_counter()
+    results = client.submit(run_load(client, args)).result()
+    elapsed = time.perf_counter() - start
+    model = client.model()
+
+    print(f"\n{'workload':<12}{'calls':>7}{'failed':>8}{'first p50':>11}{'first p95':>11}"
+          f"{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'max s':>8}")
+    summaries = []
+    for workload in WORKLOADS:
+        summary = summarize(workload, results)
+        summaries.append(summary)
+        if 'total_p50' in summary:
+            print(f"{workload:<12}{summary['calls']:>7}{summary['failed']:>8}{summary['first_p50']:>11.2f}"
+                  f"{summary['first_p95']:>11.2f}{summary['total_p50']:>8.2f}{summary['total_p95']:>8.2f}"
+                  f"{summary['total_p99']:>8.2f}{summary['total_max']:>8.2f}")
+        else:
+            print(f"{workload:<12}{summary['calls']:>7}{summary['failed']:>8}")
+    print(f"\n{len(results)} calls in {elapsed:.1f}s ({len(results) / elapsed:.2f} calls/s); "
+          f"{model.calls} model requests, {model.errors} injected errors", flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'elapsed_seconds': elapsed, 'summaries': summaries, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
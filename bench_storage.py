@@ -0,0 +1,235 @@
+"""Micro-benchmarks for the chat session/message storage layer.
+
+Builds synthetic chat databases (optionally with large generated images) and
+times the storage functions the app calls on every rerun. Each function runs
+in a fresh process so that its peak RSS is measured on its own. Needs neither
+Streamlit nor network access.
+
+Usage:
+    python bench_storage.py                        # default scenarios
+    python bench_storage.py --scenario wide deep   # pick presets
+    python bench_storage.py --sessions 2000 --messages 50 --iterations 100
+    python bench_storage.py --json results.json    # also save raw numbers
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import storage
+
+# name: (sessions, messages per session)
+SCENARIOS = {
+    'tiny': (10, 10),
+    'small': (100, 100),
+    'medium': (1_000, 100),
+    'wide': (50_000, 10),
+    'deep': (10, 10_000),
+}
+DEFAULT_SCENARIOS = ['tiny', 'small', 'deep']
+
+# Functions are benchmarked in this order; delete_session runs last because it shrinks the database.
+BENCHMARKED_FUNCTIONS = [
+    'get_all_sessions', 'get_sessions_page', 'load_session_messages',
+    'load_session_messages_page', 'search_sessions', 'save_message', 'delete_session'
+]
+
+WORDS = (
+    "black hole star galaxy nebula quasar pulsar dark matter energy cosmic ray photon "
+    "quantum gravity time space horizon singularity orbit comet planet universe light"
+).split()
+
+def random_text(rng, word_count):
+    """Space-separated random astronomy words."""
+    return " ".join(rng.choices(WORDS, k=word_count))
+
+def populate(db_path, media_dir, session_count, messages_per_session, image_every, image_bytes, seed=0):
+    """Create a synthetic database. Returns the list of session IDs.
+
+    Rows are inserted directly in one transaction for speed; the search index
+    triggers still fire, and session metadata is kept consistent.
+    """
+    rng = random.Random(seed)
+    db = storage.init_database(db_path)
+    start_time = datetime.now() - timedelta(days=1)
+    session_ids = []
+    with storage._transaction(db):
+        for s in range(session_count):
+            created_at = (start_time + timedelta(seconds=s)).isoformat()
+            cursor = db.execute(
+                "INSERT INTO sessions (session_name, persona_name, created_at, last_activity, message_count) VALUES (?, ?, ?, ?, ?)",
+                (f"Bench {s} {random_text(rng, 3)}", "Cosmic Intelligence", created_at, created_at, messages_per_session)
+            )
+            session_id = cursor.lastrowid
+            session_ids.append(session_id)
+            rows = []
+            for m in range(messages_per_session):
+                timestamp = (start_time + timedelta(seconds=s, microseconds=m)).isoformat()
+                role = "user" if m % 2 == 0 else "assistant"
+                if image_every and m % image_every == image_every - 1:
+                    content = storage.make_media_message('image', rng.randbytes(image_bytes), random_text(rng, 12), media_dir)
+                else:
+                    content = random_text(rng, 20 if role == "user" else 120)
+                rows.append((session_id, role, content, timestamp))
+            db.executemany("INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)", rows)
+            if rows:
+                db.execute("UPDATE sessions SET last_activity = ? WHERE id = ?", (rows[-1][3], session_id))
+    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return session_ids
+
+def bytes_written():
+    """Bytes this process has passed to write() so far (Linux), or None if unavailable."""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def make_operation(function_name, db, session_ids, rng):
+    """Return a zero-argument callable performing one call of the benchmarked function."""
+    deletable = list(session_ids)
+    rng.shuffle(deletable)
+    operations = {
+        'get_all_sessions': lambda: storage.get_all_sessions(db),
+        'get_sessions_page': lambda: storage.get_sessions_page(db, limit=10, offset=rng.randrange(max(1, len(session_ids) - 10))),
+        'load_session_messages': lambda: storage.load_session_messages(db, rng.choice(session_ids)),
+        'load_session_messages_page': lambda: storage.load_session_messages_page(db, rng.choice(session_ids)),
+        'search_sessions': lambda: storage.search_sessions(db, " ".join(rng.sample(WORDS, 2))),
+        'save_message': lambda: storage.save_message(db, rng.choice(session_ids), "user", random_text(rng, 40)),
+        'delete_session': lambda: storage.delete_session(db, deletable.pop()),
+    }
+    return operations[function_name]
+
+def run_function(db_path, function_name, session_ids, iterations, result_queue):
+    """Benchmark one storage function in this (fresh) process and report the numbers."""
+    rng = random.Random(1)
+    db = storage.init_database(db_path)
+    if function_name == 'delete_session':
+        iterations = min(iterations, len(session_ids) - 1)  # The warm-up call deletes one too
+    operation = make_operation(function_name, db, session_ids, rng)
+
+    operation()  # Warm up caches and the connection
+    written_before = bytes_written()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+    written_after = bytes_written()
+
+    result_queue.put({
+        'function': function_name,
+        'iterations': iterations,
+        'latencies': latencies,
+        'bytes_per_op': (written_after - written_before) / iterations if written_before is not None else None,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(result):
+    """Turn raw latencies into the reported statistics (milliseconds)."""
+    latencies = sorted(result['latencies'])
+    return {
+        'function': result['function'],
+        'iterations': result['iterations'],
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'bytes_per_op': result['bytes_per_op'],
+        'peak_rss_mb': result['peak_rss_kb'] / 1024,
+    }
+
+def directory_size(path):
+    """Total size in bytes of all files below `path`."""
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def wait_for_result(process, result_queue):
+    """Get a benchmark process's result, failing instead of hanging if it dies."""
+    while True:
+        try:
+            return result_queue.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Benchmark process exited with code {process.exitcode} without reporting results")
+
+def run_scenario(name, session_count, messages_per_session, args):
+    """Build one synthetic database and benchmark every storage function against it."""
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    try:
+        db_path = os.path.join(work_dir, "bench.db")
+        media_dir = os.path.join(work_dir, "media")
+        start = time.perf_counter()
+        session_ids = populate(db_path, media_dir, session_count, messages_per_session, args.image_every, args.image_kb * 1024)
+        populate_seconds = time.perf_counter() - start
+        db_size = os.path.getsize(db_path)
+        media_size = directory_size(media_dir) if os.path.isdir(media_dir) else 0
+
+        print(f"\n=== {name}: {session_count:,} sessions x {messages_per_session:,} messages "
+              f"(db {db_size / 1e6:.1f} MB, media {media_size / 1e6:.1f} MB, built in {populate_seconds:.1f}s) ===", flush=True)
+        print(f"{'function':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'bytes/op':>12}{'peak RSS MB':>13}", flush=True)
+
+        context = multiprocessing.get_context('spawn')
+        summaries = []
+        for function_name in args.functions:
+            result_queue = context.Queue()
+            process = context.Process(
+                target=run_function,
+                args=(db_path, function_name, session_ids, args.iterations, result_queue)
+            )
+            process.start()
+            summary = summarize(wait_for_result(process, result_queue))
+            process.join()
+            summaries.append(summary)
+            bytes_per_op = f"{summary['bytes_per_op']:,.0f}" if summary['bytes_per_op'] is not None else "n/a"
+            print(f"{function_name:<28}{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}"
+                  f"{summary['max_ms']:>10.2f}{bytes_per_op:>12}{summary['peak_rss_mb']:>13.1f}", flush=True)
+
+        return {
+            'scenario': name, 'sessions': session_count, 'messages_per_session': messages_per_session,
+            'db_bytes': db_size, 'media_bytes': media_size, 'populate_seconds': populate_seconds,
+            'results': summaries
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat storage layer on synthetic databases.")
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=DEFAULT_SCENARIOS)
+    parser.add_argument("--sessions", type=int, help="Custom scenario: number of sessions (overrides --scenario)")
+    parser.add_argument("--messages", type=int, default=100, help="Custom scenario: messages per session")
+    parser.add_argument("--iterations", type=int, default=50, help="Calls timed per function")
+    parser.add_argument("--image-every", type=int, default=50, help="Every Nth message is a generated image (0 = none)")
+    parser.add_argument("--image-kb", type=int, default=256, help="Size of each generated image")
+    parser.add_argument("--functions", nargs="+", choices=BENCHMARKED_FUNCTIONS, default=BENCHMARKED_FUNCTIONS)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    args.functions = [f for f in BENCHMARKED_FUNCTIONS if f in args.functions]
+
+    if args.sessions:
+        scenarios = [('custom', args.sessions, args.messages)]
+    else:
+        scenarios = [(name, *SCENARIOS[name]) for name in args.scenario]
+
+    report = [run_scenario(name, sessions, messages, args) for name, sessions, messages in scenarios]
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Sanity check of the semantic cache's notion of "the same question".
+
+Stores one prompt of each pair in a scratch cache and looks up the other.
+Pairs asking different things (another interrogative, a negation, a request
+for a plot) must score below the reuse threshold; paraphrases must reach it.
+Needs neither Streamlit nor network access.
+
+Usage: python check_semantic_cache.py [--threshold 0.85]
+Exits with status 1 if any pair lands on the wrong side of the threshold.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from semantic_cache import SemanticCache
+
+# Must never reuse each other's answers
+DIFFERENT_QUESTIONS = [
+    ("How do black holes form?", "Why can't black holes form?"),
+    ("How do black holes form?", "Why do black holes form?"),
+    ("Do black holes form?", "Don't black holes form?"),
+    ("Who discovered pulsars?", "When were pulsars discovered?"),
+    ("Which stars become black holes?", "Why do stars become black holes?"),
+    ("what is the size of the sun", "show me the size of the sun"),
+]
+# Should reuse each other's answers
+PARAPHRASES = [
+    ("what is a black hole", "explain black holes"),
+    ("tell me about neutron stars", "what are neutron stars?"),
+    ("please explain dark matter", "Explain dark matter."),
+]
+
+def similarity(first, second):
+    """Score the cache gives `second` after only `first` was stored."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        cache = SemanticCache(path=os.path.join(work_dir, "check.db"))
+        cache.store("check", first, "answer")
+        match = cache.lookup("check", second, threshold=0.0)
+        return match[1] if match else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threshold', type=float, default=0.85, help="Lowest reuse threshold of any persona")
+    args = parser.parse_args()
+
+    failures = 0
+    for pairs, should_match in ((DIFFERENT_QUESTIONS, False), (PARAPHRASES, True)):
+        for first, second in pairs:
+            score = similarity(first, second)
+            ok = (score >= args.threshold) == should_match
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {score:.3f}  {first!r} ~ {second!r}")
+    print(f"\n{failures} failure(s) at threshold {args.threshold:g}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
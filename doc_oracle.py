@@ -0,0 +1,280 @@
+"""Local retrieval index for the Document Oracle.
+
+Documents are split into overlapping word windows ("chunks") that remember
+their file and page. The chunks are indexed with BM25 in a SciPy sparse
+matrix when the documents are analyzed, so each question sends only the few
+most relevant chunks to the model, with citations, instead of the full text.
+For summaries, long documents are split into larger sections that are
+summarized separately and then combined.
+
+The DocumentLibrary keeps extracted text and finished summaries on disk, keyed
+by the SHA-256 of the uploaded file, so a document uploaded again (by anyone,
+in any session) is neither re-extracted nor re-summarized.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from response_cache import BUSY_TIMEOUT_SECONDS
+
+CHUNK_WORDS = 200
+CHUNK_OVERLAP_WORDS = 40
+DEFAULT_TOP_K = 6
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Size of the sections summarized one model call each when summarizing long documents
+SUMMARY_SECTION_WORDS = 6000
+
+LIBRARY_PATH = 'cosmic_library.db'
+DEFAULT_LIBRARY_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_LIBRARY_MAX_SUMMARIES = 5000
+
+LIBRARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    content_hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    pages BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_last_used ON documents (last_used);
+CREATE TABLE IF NOT EXISTS summaries (
+    key TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_summaries_last_used ON summaries (last_used);
+"""
+
+# --- CHUNKING ---
+def tokenize(text):
+    """Lowercase word tokens used for indexing and querying."""
+    return re.findall(r'\w+', text.lower())
+
+def chunk_document(name, pages, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS):
+    """Split a document into chunks of about `chunk_words` words, consecutive chunks sharing `overlap_words`.
+
+    `pages` holds the text of each page (PDFs), or a single entry for documents
+    without pages. Chunks never span pages, so every chunk cites one page.
+    """
+    paged = len(pages) > 1
+    step = max(1, chunk_words - overlap_words)
+    chunks = []
+    for page_number, page_text in enumerate(pages, start=1):
+        words = page_text.split()
+        for start in range(0, len(words), step):
+            chunks.append({
+                'source': name,
+                'page': page_number if paged else None,
+                'part': len(chunks) + 1,
+                'text': " ".join(words[start:start + chunk_words])
+            })
+            if start + chunk_words >= len(words):
+                break
+    return chunks
+
+def split_for_summary(text, max_words=SUMMARY_SECTION_WORDS):
+    """Split one document's text into consecutive sections of at most `max_words` words.
+
+    Sections end at paragraph breaks where possible. The split depends only on
+    the document itself, so the same document always yields the same sections.
+    """
+    sections, current, current_words = [], [], 0
+    for paragraph in re.split(r'\n\s*\n', text):
+        words = paragraph.split()
+        if current and current_words + len(words) > max_words:
+            sections.append("\n\n".join(current))
+            current, current_words = [], 0
+        while len(words) > max_words:
+            sections.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        if words:
+            current.append(" ".join(words))
+            current_words += len(words)
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
+def citation(chunk):
+    """Human-readable location of a chunk, e.g. "report.pdf, p. 4"."""
+    if chunk['page'] is not None:
+        return f"{chunk['source']}, p. {chunk['page']}"
+    return f"{chunk['source']}, part {chunk['part']}"
+
+# --- INDEX ---
+class DocumentIndex:
+    """Okapi BM25 index over document chunks.
+
+    The per-chunk BM25 term weights are computed once into a sparse matrix, so
+    scoring a question is a column slice and a sparse-dense product.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.vocabulary = {}
+        rows, columns, counts, lengths = [], [], [], []
+        for row, chunk in enumerate(chunks):
+            term_counts = Counter(tokenize(chunk['text']))
+            lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                rows.append(row)
+                columns.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                counts.append(count)
+
+        shape = (len(chunks), len(self.vocabulary))
+        weights = sparse.csr_matrix((np.array(counts, dtype=np.float32), (rows, columns)), shape=shape)
+        lengths = np.array(lengths, dtype=np.float32)
+        average_length = max(float(lengths.mean()), 1.0) if len(lengths) else 1.0
+        document_frequency = np.bincount(np.array(columns, dtype=np.int64), minlength=shape[1])
+        self.idf = np.log1p((shape[0] - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+
+        # Term frequency saturation with document length normalisation, row by row
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+        row_norm = np.repeat(length_norm, np.diff(weights.indptr))
+        weights.data = weights.data * (BM25_K1 + 1) / (weights.data + row_norm)
+        self.weights = weights.tocsc()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @classmethod
+    def from_documents(cls, documents, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS):
+        """Build an index from (name, pages) pairs."""
+        chunks = []
+        for name, pages in documents:
+            chunks.extend(chunk_document(name, pages, chunk_words, overlap_words))
+        return cls(chunks)
+
+    def search(self, query, top_k=DEFAULT_TOP_K):
+        """Return up to `top_k` (chunk, score) pairs sharing terms with `query`, best first."""
+        terms = sorted({self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary})
+        if not terms:
+            return []
+        scores = self.weights[:, terms] @ self.idf[terms]
+        scores = np.asarray(scores).ravel()
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(self.chunks[i], float(scores[i])) for i in ranked]
+
+def format_excerpts(results):
+    """Numbered excerpts for a prompt, each headed by its citation, e.g. "[1] (report.pdf, p. 4)"."""
+    return "\n\n".join(
+        f"[{number}] ({citation(chunk)})\n{chunk['text']}"
+        for number, (chunk, _) in enumerate(results, start=1)
+    )
+
+# --- LIBRARY ---
+def content_hash(data):
+    """Library key of an uploaded file: SHA-256 of its bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+def summary_key(content_hashes):
+    """Library key of the summary of several documents, in upload order."""
+    return hashlib.sha256("\n".join(content_hashes).encode('utf-8')).hexdigest()
+
+class DocumentLibrary:
+    """SQLite-backed store of extracted document text and summaries, shared by all sessions.
+
+    Page texts are stored zlib-compressed. The least recently used documents
+    are evicted once they pass `max_bytes`, and the least recently used
+    summaries beyond `max_summaries`. Each thread gets its own connection.
+    """
+
+    def __init__(self, path=LIBRARY_PATH, max_bytes=DEFAULT_LIBRARY_MAX_BYTES,
+                 max_summaries=DEFAULT_LIBRARY_MAX_SUMMARIES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_summaries = max_summaries
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+        self._schema_ready = False
+
+    def _connection(self):
+        """Return the calling thread's connection, creating the schema on first use."""
+        db = getattr(self._thread_local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            with self._lock:
+                if not self._schema_ready:
+                    db.executescript(f"BEGIN IMMEDIATE;{LIBRARY_SCHEMA}COMMIT;")
+                    self._schema_ready = True
+            self._thread_local.db = db
+        return db
+
+    def get_pages(self, key):
+        """Return the stored page texts of a document, or None if it is not in the library."""
+        db = self._connection()
+        row = db.execute("SELECT pages FROM documents WHERE content_hash = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE documents SET last_used = ? WHERE content_hash = ?", (time.time(), key))
+        return json.loads(zlib.decompress(row['pages']).decode('utf-8'))
+
+    def add_document(self, key, name, pages):
+        """Store a document's page texts, then evict the least recently used documents over the size limit."""
+        data = zlib.compress(json.dumps(pages).encode('utf-8'))
+        db = self._connection()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO documents (content_hash, name, pages, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, name, data, len(data), now, now)
+            )
+            total_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+            if total_bytes > self.max_bytes:
+                victims = []
+                for row in db.execute("SELECT content_hash, size FROM documents WHERE content_hash != ? ORDER BY last_used", (key,)):
+                    if total_bytes <= self.max_bytes:
+                        break
+                    victims.append((row['content_hash'],))
+                    total_bytes -= row['size']
+                db.executemany("DELETE FROM documents WHERE content_hash = ?", victims)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def get_summary(self, key):
+        """Return the stored summary for a `summary_key`, or None."""
+        db = self._connection()
+        row = db.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE summaries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row['summary']
+
+    def put_summary(self, key, summary):
+        """Store the summary of the documents behind a `summary_key`, evicting the least recently used beyond the limit."""
+        db = self._connection()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, summary, now, now)
+            )
+            db.execute(
+                "DELETE FROM summaries WHERE key NOT IN (SELECT key FROM summaries ORDER BY last_used DESC LIMIT ?)",
+                (self.max_summaries,)
+            )
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
@@ -0,0 +1,310 @@
+"""Offline stand-in for the Gemini models, for load tests and benchmarks.
+
+MockModel answers like `genai.GenerativeModel` (`generate_content_async`,
+streamed or not) without network access or an API key. Answers come from
+templates picked by what the prompt asks for, so the features that parse the
+model's output keep working: follow-up suggestions, the Genesis Engine, Code
+Alchemist, Cosmic Symphony and Oneiros get valid JSON (with sound code that
+builds a `wav_buffer`), the Data Storyteller gets runnable Plotly code, the
+Cognitive Twin a persona, and image requests an actual PNG.
+
+Latency, the delay between streamed chunks and the error rate are
+configurable. Errors are the retryable ones the real API raises (429, 503).
+Answers depend only on the prompt, and latencies and errors only on the seed,
+the prompt and how often it was asked, so a run can be repeated exactly.
+
+The app uses it when EVENT_HORIZON_MODEL_BACKEND=mock (see `settings_from_env`).
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import threading
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+from google.api_core import exceptions as api_exceptions
+from PIL import Image
+
+DEFAULT_LATENCY_SECONDS = 0.8
+DEFAULT_LATENCY_JITTER = 0.25  # Latencies vary uniformly by this fraction either way
+DEFAULT_CHUNK_DELAY_SECONDS = 0.05
+DEFAULT_CHUNK_WORDS = 8
+DEFAULT_ERROR_RATE = 0.0
+DEFAULT_RESPONSE_WORDS = 150
+IMAGE_SIZE = 256
+
+# Environment variables read by `settings_from_env` (root-level Streamlit secrets are exported to the environment too)
+ENV_BACKEND = 'EVENT_HORIZON_MODEL_BACKEND'
+ENV_SETTINGS = {
+    'latency': ('EVENT_HORIZON_MOCK_LATENCY', float),
+    'chunk_delay': ('EVENT_HORIZON_MOCK_CHUNK_DELAY', float),
+    'error_rate': ('EVENT_HORIZON_MOCK_ERROR_RATE', float),
+    'response_words': ('EVENT_HORIZON_MOCK_RESPONSE_WORDS', int),
+    'seed': ('EVENT_HORIZON_MOCK_SEED', int),
+}
+
+FILLER_SENTENCES = [
+    "Across the cosmic web, matter gathers along filaments of dark matter, and galaxies light up where they cross.",
+    "Near a black hole, time itself slows for a distant observer, and the event horizon marks where escape becomes impossible.",
+    "Stars forge the elements heavier than helium, scattering them in supernovae that seed the next generation of worlds.",
+    "The cosmic microwave background is the afterglow of the early universe, cooled to under three kelvin by expansion.",
+    "Quantum fluctuations in the first instants, stretched by inflation, became the seeds of every structure we see today.",
+    "Neutron stars pack more than the Sun's mass into a sphere the size of a city, spinning hundreds of times a second.",
+    "Gravitational waves ripple outward from merging black holes, stretching and squeezing space as they pass.",
+    "Dark energy drives the accelerating expansion of the universe, yet its nature remains one of the deepest open questions.",
+]
+
+GENESIS_APP = '''import streamlit as st
+import pandas as pd
+import numpy as np
+
+st.title("Mock Cosmic Explorer")
+count = st.slider("Stars", 10, 500, 100)
+stars = pd.DataFrame(np.random.randn(count, 2), columns=["x", "y"])
+st.scatter_chart(stars, x="x", y="y")
+'''
+
+SOUND_CODE = '''import numpy as np
+from scipy.io import wavfile
+import io
+
+sample_rate = 22050
+duration = 2.0
+t = np.linspace(0., duration, int(sample_rate * duration), endpoint=False)
+envelope = np.sin(np.pi * t / duration)
+audio_data = envelope * (np.sin(2. * np.pi * 110.0 * t) + 0.3 * np.sin(2. * np.pi * 165.0 * t))
+audio_data = np.int16(audio_data / np.max(np.abs(audio_data)) * 32767)
+
+wav_buffer = io.BytesIO()
+wavfile.write(wav_buffer, sample_rate, audio_data)
+wav_buffer.seek(0)'''
+
+STORY_CHART_CODE = '''numeric = df.select_dtypes('number').columns
+if len(numeric):
+    fig = go.Figure(data=go.Histogram(x=df[numeric[0]]))
+    fig.update_layout(title=f"Distribution of {numeric[0]}")
+else:
+    counts = df[df.columns[0]].astype(str).value_counts().head(20)
+    fig = go.Figure(data=go.Bar(x=counts.index, y=counts.values))
+    fig.update_layout(title=f"Most common values of {df.columns[0]}")
+apply_cosmic_theme(fig, 'Nebula Burst')'''
+
+# --- PROMPT TEMPLATES ---
+def prompt_text(contents):
+    """The text parts of a request (strings, lists of parts, or content dicts), joined."""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return prompt_text(contents.get('parts', []))
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(text for text in (prompt_text(part) for part in contents) if text)
+    return ""
+
+def _topic(prompt, words=8):
+    """A short excerpt of what the user asked, for echoing back."""
+    for pattern in (r"\*\*User's (?:Query|Question|Request|Instruction|Focus|Description):\*\*\s*(.+)", r'User: "(.+?)"'):
+        match = re.search(pattern, prompt)
+        if match:
+            prompt = match.group(1)
+            break
+    return " ".join(prompt.split()[:words]).strip(' "*') or "the cosmos"
+
+def _filler(prompt, words):
+    """Deterministic prose of about `words` words, its starting sentence picked by the prompt."""
+    start = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest(), 16) % len(FILLER_SENTENCES)
+    sentences, count = [], 0
+    while count < words:
+        sentence = FILLER_SENTENCES[(start + len(sentences)) % len(FILLER_SENTENCES)]
+        sentences.append(sentence)
+        count += len(sentence.split())
+    return " ".join(sentences)
+
+def _json_block(data):
+    return "```json\n" + json.dumps(data, indent=2) + "\n```"
+
+def _suggestions(prompt, response_words):
+    topic = _topic(prompt, words=5).rstrip('?.!')
+    return json.dumps([
+        f"Can you go deeper into {topic}?",
+        "How was this discovered?",
+        "What questions remain open?"
+    ])
+
+def _genesis(prompt, response_words):
+    return _json_block({
+        'app.py': GENESIS_APP,
+        'requirements.txt': "streamlit\npandas\nnumpy\n",
+        'README.md': "# Mock Cosmic Explorer\n\nGenerated offline by the mock model backend.\n"
+    })
+
+def _alchemist(prompt, response_words):
+    match = re.search(r"\*\*Current Code:\*\*\s*```\w*\n(.*?)\n```", prompt, re.DOTALL)
+    code = match.group(1) if match else "print('Hello from the mock Code Alchemist')"
+    return _json_block({
+        'new_code': f"# Refined by the mock model\n{code}",
+        'explanation': f"Mock refactor for: {_topic(prompt)}. The code is unchanged apart from a header comment."
+    })
+
+def _sound(prompt, response_words):
+    return _json_block({
+        'description': "A slow, swelling drone with a fifth above it, like a star breathing.",
+        'code': SOUND_CODE
+    })
+
+def _story(prompt, response_words):
+    return (
+        f"## The Story in the Data\n\n{_filler(prompt, response_words // 2)}\n\n"
+        f"### A First Look\n\n```python\n{STORY_CHART_CODE}\n```\n\n"
+        f"### Key Takeaways\n\n{_filler(prompt[::-1], response_words // 2)}"
+    )
+
+def _twin(prompt, response_words):
+    return (
+        "You are a Cognitive Twin to the user. Mirror their curiosity and their concise, direct style, "
+        "favour concrete examples, and end with a question that pushes the idea further."
+    )
+
+def _default(prompt, response_words):
+    return f"**Mock response** about _{_topic(prompt)}_.\n\n{_filler(prompt, response_words)}"
+
+# (marker found in the prompt, template), checked in order
+TEMPLATES = [
+    ("Return as JSON list of strings", _suggestions),
+    ("You are the Genesis Engine", _genesis),
+    ('"new_code"', _alchemist),
+    ("wav_buffer", _sound),
+    ('"Data Storyteller,"', _story),
+    ('start with "You are a Cognitive Twin', _twin),
+]
+
+def mock_answer(prompt, response_words=DEFAULT_RESPONSE_WORDS):
+    """The text the mock model answers to `prompt`."""
+    for marker, template in TEMPLATES:
+        if marker in prompt:
+            return template(prompt, response_words)
+    return _default(prompt, response_words)
+
+def mock_image(prompt):
+    """PNG bytes of a nebula-like gradient whose colours depend on the prompt."""
+    seed = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8], 16)
+    colours = np.random.default_rng(seed).uniform(40, 255, size=(2, 3))
+    y, x = np.mgrid[-1:1:IMAGE_SIZE * 1j, -1:1:IMAGE_SIZE * 1j]
+    glow = np.exp(-3 * (x ** 2 + y ** 2))[..., None]
+    pixels = (glow * colours[0] + (1 - glow) * colours[1] * 0.25).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, 'RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+# --- RESPONSES ---
+def _text_response(text):
+    return SimpleNamespace(
+        text=text,
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text, inline_data=None)]))],
+        prompt_feedback=SimpleNamespace(block_reason=None)
+    )
+
+def _image_response(image_bytes, description):
+    parts = [
+        SimpleNamespace(text="", inline_data=SimpleNamespace(mime_type='image/png', data=image_bytes)),
+        SimpleNamespace(text=description, inline_data=None)
+    ]
+    return SimpleNamespace(
+        text=description,
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))],
+        prompt_feedback=SimpleNamespace(block_reason=None)
+    )
+
+class _MockStream:
+    """Async iterator over the chunks of a streamed answer, `delay` seconds apart."""
+
+    def __init__(self, text, chunk_words, delay):
+        words = re.findall(r'\S+\s*', text)
+        self.chunks = ["".join(words[i:i + chunk_words]) for i in range(0, len(words), chunk_words)]
+        self.delay = delay
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for number, chunk in enumerate(self.chunks):
+            if number:
+                await asyncio.sleep(self.delay)
+            yield SimpleNamespace(text=chunk)
+
+# --- MODEL ---
+class MockModel:
+    """Drop-in for `genai.GenerativeModel` that answers from local templates.
+
+    Each call waits `latency` seconds (varied by `jitter`) before its answer or
+    first chunk, then `chunk_delay` seconds per further chunk of `chunk_words`
+    words; a non-streamed call waits for all of them. With probability
+    `error_rate` a call fails after its latency with a rate limit or
+    unavailable error, as the real API does.
+    """
+
+    def __init__(self, model_name, latency=DEFAULT_LATENCY_SECONDS, jitter=DEFAULT_LATENCY_JITTER,
+                 chunk_delay=DEFAULT_CHUNK_DELAY_SECONDS, chunk_words=DEFAULT_CHUNK_WORDS,
+                 error_rate=DEFAULT_ERROR_RATE, response_words=DEFAULT_RESPONSE_WORDS, seed=0):
+        # Distinct from real model names, so mock answers never mix with real ones in the response cache
+        self.model_name = f"mock/{model_name}"
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.chunk_words = chunk_words
+        self.error_rate = error_rate
+        self.response_words = response_words
+        self.seed = seed
+        self.calls = 0
+        self.errors = 0
+        self._asked = Counter()  # Prompt digest -> times asked
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, **settings):
+        """A backend for `ModelClient`: model name -> MockModel with these settings."""
+        return lambda model_name: cls(model_name, **settings)
+
+    def _rng(self, prompt):
+        """Random numbers for one call, fixed by the seed, the prompt and how often it was asked before."""
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        with self._lock:
+            self.calls += 1
+            asked = self._asked[digest]
+            self._asked[digest] += 1
+        return random.Random(f"{self.seed}:{self.model_name}:{digest}:{asked}")
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        prompt = prompt_text(contents)
+        rng = self._rng(prompt)
+        await asyncio.sleep(self.latency * rng.uniform(1 - self.jitter, 1 + self.jitter))
+        if rng.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            if rng.random() < 0.5:
+                raise api_exceptions.TooManyRequests("Mock rate limit exceeded")
+            raise api_exceptions.ServiceUnavailable("Mock model unavailable")
+
+        if prompt.startswith("Generate an image:"):
+            return _image_response(mock_image(prompt), f"A mock rendering of {_topic(prompt)}.")
+
+        answer = mock_answer(prompt, self.response_words)
+        response = _MockStream(answer, self.chunk_words, self.chunk_delay)
+        if stream:
+            return response
+        await asyncio.sleep(self.chunk_delay * max(0, len(response.chunks) - 1))
+        return _text_response(answer)
+
+def settings_from_env(environ=os.environ):
+    """MockModel settings from the environment, or None unless EVENT_HORIZON_MODEL_BACKEND is "mock"."""
+    if environ.get(ENV_BACKEND, '').strip().lower() != 'mock':
+        return None
+    settings = {}
+    for name, (variable, convert) in ENV_SETTINGS.items():
+        if environ.get(variable):
+            settings[name] = convert(environ[variable])
+    return settings
@@ -0,0 +1,459 @@
+"""Shared asyncio client for the Gemini models used by Event Horizon.
+
+Every model call goes through one ModelClient per server process. It runs a
+single event loop on a background thread, so model handles and the SDK's
+gRPC channel are created once and reused by every session, and it adds what
+the bare SDK calls lack:
+
+* a deadline per call that covers all of its attempts (`timeout`);
+* retries with jittered exponential backoff on rate limits (429) and server errors (5xx);
+* the on-disk response cache (pass `use_cache=False` to bypass it);
+* fan-out of several generations at once (`generate_many`);
+* admission control: a token bucket and a concurrency cap shared by all
+  calls, queueing the rest by priority and round-robin between users.
+
+The coroutines (`generate_async`, `stream_async`) are the API proper;
+`generate`, `stream` and `generate_many` are blocking wrappers for the
+Streamlit script thread and the background worker threads, and `start`
+runs a generation in the background as a cancellable Generation. These
+attribute calls to the user and priority set with `set_caller` (or
+`caller_priority`) in the calling context.
+
+Model handles come from `backend`, `genai.GenerativeModel` by default; the
+offline MockModel (mock_model.py) can stand in for it in load tests.
+"""
+import asyncio
+import contextlib
+import contextvars
+import logging
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import as_completed
+
+import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+
+from response_cache import CachedResponse, fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'gemma-3-27b-it'
+DEFAULT_TIMEOUT_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 4
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 20.0
+DEFAULT_FAN_OUT = 4
+
+# Admission control for API calls (cache hits are free): sustained rate, burst size, calls in flight
+DEFAULT_RATE_PER_MINUTE = 30
+DEFAULT_BURST = 10
+DEFAULT_MAX_CONCURRENT = 8
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0  # Chat replies someone is watching stream in
+PRIORITY_TOOL = 1  # Tools run from the sidebar
+PRIORITY_BACKGROUND = 2  # Suggestions, memory, persona evolution, audits
+
+# Rate limiting (429) and transient server errors (500, 502, 503, 504)
+RETRYABLE_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+)
+
+_caller = contextvars.ContextVar('model_caller', default=(None, PRIORITY_TOOL))
+
+def set_caller(user, priority=PRIORITY_TOOL):
+    """Attribute the model calls made from the current context to `user`, at `priority` unless a call says otherwise."""
+    _caller.set((user, priority))
+
+@contextlib.contextmanager
+def caller_priority(priority):
+    """Make the model calls inside the block run at `priority`."""
+    user, _ = _caller.get()
+    token = _caller.set((user, priority))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+def backoff_delay(attempt):
+    """Seconds to wait after failed attempt number `attempt` (from 1): exponential, with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+class AdmissionController:
+    """Token bucket plus concurrency cap in front of the API, with a fair queue.
+
+    Callers that cannot start at once wait in one queue per priority; within
+    a priority, users take turns, so one user's batch of calls cannot starve
+    everyone else. Only used from the client's event loop.
+    """
+
+    def __init__(self, rate_per_minute=DEFAULT_RATE_PER_MINUTE, burst=DEFAULT_BURST,
+                 max_concurrent=DEFAULT_MAX_CONCURRENT):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.tokens = float(burst)
+        self.active = 0
+        self.waiting = 0
+        self.recent_waits = deque(maxlen=100)  # Seconds the latest admitted calls spent queued
+        self._updated = time.monotonic()
+        self._queues = {}  # Priority -> OrderedDict of user -> deque of waiting futures
+        self._timer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _next_waiter(self):
+        """Pop the next future to admit: best priority first, then the user whose turn it is.
+
+        Futures of callers that gave up since they queued are dropped on the way.
+        """
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user, waiters = next(iter(users.items()))
+                users.move_to_end(user)
+                while waiters:
+                    future = waiters.popleft()
+                    self.waiting -= 1
+                    if not future.done():
+                        if not waiters:
+                            del users[user]
+                        return future
+                del users[user]
+            del self._queues[priority]
+        return None
+
+    def _dispatch(self):
+        self._timer = None
+        self._refill()
+        while self.waiting and self.active < self.max_concurrent and self.tokens >= 1:
+            future = self._next_waiter()
+            if future is None:
+                break
+            self.active += 1
+            self.tokens -= 1
+            future.set_result(None)
+        if self.waiting and self.active < self.max_concurrent and self._timer is None:
+            # Out of tokens: come back when the next one has accumulated
+            self._timer = asyncio.get_running_loop().call_later((1 - self.tokens) / self.rate, self._dispatch)
+
+    async def acquire(self, user, priority):
+        """Wait until this call may go out."""
+        self._refill()
+        if not self.waiting and self.active < self.max_concurrent and self.tokens >= 1:
+            self.active += 1
+            self.tokens -= 1
+            self.recent_waits.append(0.0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(priority, OrderedDict()).setdefault(user, deque()).append(future)
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Admitted just as the caller gave up
+            else:
+                # Unless `_dispatch` already dropped it, take the future out of the queue
+                waiters = self._queues.get(priority, {}).get(user)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    self.waiting -= 1
+            raise
+        self.recent_waits.append(time.monotonic() - started)
+
+    def release(self):
+        """A call admitted by `acquire` has finished."""
+        self.active -= 1
+        self._dispatch()
+
+    def stats(self):
+        """Snapshot of the queue: calls waiting (overall and per priority), in flight, and recent wait times."""
+        return {
+            'waiting': self.waiting,
+            'waiting_by_priority': {
+                priority: count for priority, users in self._queues.items()
+                if (count := sum(len(waiters) for waiters in users.values()))
+            },
+            'active': self.active,
+            'average_wait': sum(self.recent_waits) / len(self.recent_waits) if self.recent_waits else 0.0,
+            'max_recent_wait': max(self.recent_waits, default=0.0)
+        }
+
+class Generation:
+    """Handle on a generation running in the background: poll it, read its text as it streams, or cancel it.
+
+    Cancelling cancels the SDK request itself and frees its admission slot;
+    the text received until then stays available in `text`.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.chunks = []  # Appended on the client's loop as the stream arrives
+        self.future = None
+
+    @property
+    def text(self):
+        """Text received so far (all of it, once a streamed generation is done)."""
+        return "".join(self.chunks)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        return self.future.cancel()
+
+    def cancelled(self):
+        return self.future.cancelled()
+
+    def exception(self):
+        """The error the generation failed with (TimeoutError past its deadline), or None if it succeeded, was cancelled or is running."""
+        if not self.future.done() or self.future.cancelled():
+            return None
+        return self.future.exception()
+
+    def result(self):
+        """The full text of a streamed generation, or the response of a non-streamed one; blocks until done."""
+        return self.future.result()
+
+class ModelClient:
+    """Thread-safe entry point for all generations, shared by every session of the process."""
+
+    def __init__(self, cache=None, default_model=DEFAULT_MODEL, rate_per_minute=DEFAULT_RATE_PER_MINUTE,
+                 burst=DEFAULT_BURST, max_concurrent=DEFAULT_MAX_CONCURRENT, backend=genai.GenerativeModel):
+        self.cache = cache
+        self.default_model = default_model
+        self.backend = backend  # Model name -> model handle, e.g. `mock_model.MockModel.factory()` offline
+        self.admission = AdmissionController(rate_per_minute, burst, max_concurrent)
+        self._models = {}  # Model name -> handle from `backend`
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="model-client", daemon=True)
+        self._thread.start()
+
+    def model(self, model_name=None):
+        """Return the shared handle of a model, creating it on first use."""
+        model_name = model_name or self.default_model
+        handle = self._models.get(model_name)
+        if handle is None:
+            handle = self._models.setdefault(model_name, self.backend(model_name))
+        return handle
+
+    def submit(self, coroutine):
+        """Schedule a coroutine on the client's loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def queue_stats(self):
+        """Current admission queue statistics (see `AdmissionController.stats`)."""
+        async def snapshot():
+            return self.admission.stats()
+        return self.submit(snapshot()).result()
+
+    # --- COROUTINES ---
+    async def _cached_text(self, key):
+        if key is None:
+            return None
+        return await asyncio.to_thread(self.cache.get, key)
+
+    async def _store(self, key, model_name, text):
+        if key is not None and text:
+            await asyncio.to_thread(self.cache.put, key, model_name, text)
+
+    def _cache_key(self, handle, contents, use_cache, kwargs):
+        if not use_cache or self.cache is None:
+            return None
+        return fingerprint(handle.model_name, contents, kwargs)
+
+    async def _with_retries(self, start_call, timeout, max_attempts, user, priority, hold=False):
+        """Await `start_call()` until it succeeds, retrying retryable errors until the deadline or attempt limit.
+
+        Every attempt waits for admission first, and the deadline includes that
+        wait. With `hold`, the admission slot stays taken after success and
+        the caller must release it.
+        """
+        async def attempt_call():
+            await self.admission.acquire(user, priority)
+            try:
+                result = await start_call()
+            except BaseException:
+                self.admission.release()
+                raise
+            if not hold:
+                self.admission.release()
+            return result
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return await asyncio.wait_for(attempt_call(), max(0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"The model did not answer within {timeout:g} seconds") from None
+            except RETRYABLE_ERRORS as e:
+                delay = backoff_delay(attempt)
+                if attempt == max_attempts or loop.time() + delay >= deadline:
+                    raise
+                logger.warning("Model call failed (%s), retry %d/%d in %.1fs", e, attempt, max_attempts - 1, delay)
+                await asyncio.sleep(delay)
+
+    async def generate_async(self, contents, *, model_name=None, timeout=DEFAULT_TIMEOUT_SECONDS,
+                             max_attempts=DEFAULT_MAX_ATTEMPTS, use_cache=True, user=None,
+                             priority=PRIORITY_TOOL, **kwargs):
+        """Generate a complete response. Other keyword arguments go to `GenerativeModel.generate_content_async`.
+
+        Returns the SDK response, or a CachedResponse (which only has `text`)
+        when the response cache already holds the answer.
+        """
+        handle = self.model(model_name)
+        key = self._cache_key(handle, contents, use_cache, kwargs)
+        text = await self._cached_text(key)
+        if text is not None:
+            return CachedResponse(text)
+
+        response = await self._with_retries(
+            lambda: handle.generate_content_async(contents, **kwargs), timeout, max_attempts, user, priority
+        )
+        try:
+            await self._store(key, handle.model_name, response.text)
+        except ValueError:
+            pass  # No text, e.g. a blocked prompt; the caller sees that on the response
+        return response
+
+    async def stream_async(self, contents, *, model_name=None, timeout=DEFAULT_TIMEOUT_SECONDS,
+                           max_attempts=DEFAULT_MAX_ATTEMPTS, use_cache=True, user=None,
+                           priority=PRIORITY_TOOL, **kwargs):
+        """Yield the response text chunk by chunk.
+
+        Retries only happen before the first chunk arrives. The deadline
+        covers the whole stream, which holds its admission slot until it ends;
+        the joined text is cached once it is complete.
+        """
+        handle = self.model(model_name)
+        key = self._cache_key(handle, contents, use_cache, kwargs)
+        text = await self._cached_text(key)
+        if text is not None:
+            yield text
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        response = await self._with_retries(
+            lambda: handle.generate_content_async(contents, stream=True, **kwargs), timeout, max_attempts,
+            user, priority, hold=True
+        )
+        chunks = response.__aiter__()
+        texts = []
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"The model did not finish within {timeout:g} seconds") from None
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # Chunk without text, e.g. only safety or finish metadata
+                texts.append(text)
+                yield text
+        finally:
+            self.admission.release()
+        await self._store(key, handle.model_name, "".join(texts))
+
+    # --- BLOCKING WRAPPERS ---
+    @staticmethod
+    def _caller_options(options):
+        """Fill in the calling context's user and priority unless given."""
+        user, priority = _caller.get()
+        return {'user': user, 'priority': priority, **options}
+
+    def generate(self, contents, **options):
+        """Blocking `generate_async`."""
+        return self.submit(self.generate_async(contents, **self._caller_options(options))).result()
+
+    def stream(self, contents, **options):
+        """Blocking `stream_async`: a plain generator of text chunks.
+
+        Closing the generator early (e.g. when Streamlit stops the script)
+        cancels the request.
+        """
+        options = self._caller_options(options)
+        chunks = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for text in self.stream_async(contents, **options):
+                    chunks.put(text)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(done)
+
+        future = self.submit(pump())
+        try:
+            while (item := chunks.get()) is not done:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def start(self, contents, *, stream=True, timeout=DEFAULT_TIMEOUT_SECONDS, **options):
+        """Start a generation in the background and return its Generation handle without waiting.
+
+        Streamed generations collect their text in `Generation.text` as it arrives.
+        """
+        options = self._caller_options(options)
+        generation = Generation(timeout)
+
+        async def run():
+            if not stream:
+                return await self.generate_async(contents, timeout=timeout, **options)
+            async for text in self.stream_async(contents, timeout=timeout, **options):
+                generation.chunks.append(text)
+            return generation.text
+
+        generation.future = self.submit(run())
+        return generation
+
+    def generate_many(self, contents_list, *, on_done=None, concurrency=DEFAULT_FAN_OUT, **options):
+        """Generate responses for several requests, at most `concurrency` at a time; results keep input order.
+
+        `on_done(done, total)` is called on the calling thread as each one
+        finishes. If any request fails, the others are cancelled and the error is raised.
+        """
+        options = self._caller_options(options)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(contents):
+            async with semaphore:
+                return await self.generate_async(contents, **options)
+
+        futures = {self.submit(limited(contents)): i for i, contents in enumerate(contents_list)}
+        results = [None] * len(futures)
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if on_done:
+                    on_done(done, len(futures))
+        finally:
+            for future in futures:
+                future.cancel()
+        return results
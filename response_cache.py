@@ -0,0 +1,174 @@
+"""Disk-backed cache of model responses for Event Horizon.
+
+Identical requests (same model, context, prompt, attachments and generation
+settings) are answered from a local SQLite file instead of calling the API
+again. Entries expire after a TTL, and the least recently used ones are evicted
+once the cache grows past its entry or size limit. The ModelClient
+(model_client.py) consults it on every call; callers opt out per call with
+`use_cache=False`.
+"""
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+CACHE_PATH = 'cosmic_cache.db'
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+BUSY_TIMEOUT_SECONDS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+"""
+
+# --- FINGERPRINTS ---
+def _feed(digest, part):
+    """Hash one request part. Every value is length-prefixed so different requests never collide by concatenation."""
+    if isinstance(part, str):
+        data = part.encode('utf-8')
+        digest.update(b's%d:' % len(data) + data)
+    elif isinstance(part, (bytes, bytearray)):
+        digest.update(b'b%d:' % len(part) + bytes(part))
+    elif isinstance(part, (list, tuple)):
+        digest.update(b'l%d:' % len(part))
+        for item in part:
+            _feed(digest, item)
+    elif isinstance(part, dict):
+        digest.update(b'd%d:' % len(part))
+        for name in sorted(part, key=str):
+            _feed(digest, str(name))
+            _feed(digest, part[name])
+    elif hasattr(part, 'tobytes'):
+        # PIL images and NumPy arrays: hash the pixels/values, not the object identity
+        _feed(digest, f"{type(part).__name__}:{getattr(part, 'mode', '')}:{getattr(part, 'size', '')}:{getattr(part, 'shape', '')}")
+        _feed(digest, part.tobytes())
+    else:
+        _feed(digest, repr(part))
+
+def fingerprint(model_name, contents, settings=None):
+    """Cache key of a request: SHA-256 over the model name, contents and generation settings."""
+    digest = hashlib.sha256()
+    _feed(digest, [model_name, contents, settings or {}])
+    return digest.hexdigest()
+
+# --- CACHE ---
+class ResponseCache:
+    """SQLite-backed LRU cache of response texts with a TTL.
+
+    Each thread gets its own connection. Hit and miss counters cover this
+    process; the `hits` column keeps a per-entry count across restarts.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+        self._schema_ready = False
+
+    def _connection(self):
+        """Return the calling thread's connection, creating the schema on first use."""
+        db = getattr(self._thread_local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            with self._lock:
+                if not self._schema_ready:
+                    db.executescript(f"BEGIN IMMEDIATE;{SCHEMA}COMMIT;")
+                    self._schema_ready = True
+            self._thread_local.db = db
+        return db
+
+    def get(self, key):
+        """Return the cached text for `key`, or None if it is missing or expired."""
+        db = self._connection()
+        now = time.time()
+        row = db.execute("SELECT text, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row['created_at'] > self.ttl_seconds:
+            with self._lock:
+                self.misses += 1
+            return None
+        db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        with self._lock:
+            self.hits += 1
+        return row['text']
+
+    def put(self, key, model_name, text):
+        """Store a response text, then drop expired entries and evict the least recently used ones over the limits."""
+        db = self._connection()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, text, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, text, len(text.encode('utf-8')), now, now)
+            )
+            db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            entries, total_bytes = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if entries > self.max_entries or total_bytes > self.max_bytes:
+                evicted_bytes = 0
+                victims = []
+                for row in db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                    if entries - len(victims) <= self.max_entries and total_bytes - evicted_bytes <= self.max_bytes:
+                        break
+                    victims.append((row['key'],))
+                    evicted_bytes += row['size']
+                db.executemany("DELETE FROM responses WHERE key = ?", victims)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def clear(self):
+        """Remove every cached response."""
+        self._connection().execute("DELETE FROM responses")
+
+    def stats(self):
+        """Return this process's hit/miss counters plus the size of the cache on disk."""
+        entries, total_bytes, stored_hits = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM responses"
+        ).fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'bytes': total_bytes,
+                'stored_hits': stored_hits
+            }
+
+# --- CACHED RESPONSES ---
+class CachedResponse:
+    """Stand-in for a Gemini response served from the cache; only `text` is available."""
+
+    def __init__(self, text):
+        self.text = text
+
+if __name__ == "__main__":
+    # Usage: python response_cache.py [--clear] [cosmic_cache.db]
+    args = [arg for arg in sys.argv[1:] if arg != '--clear']
+    cache = ResponseCache(args[0] if args else CACHE_PATH)
+    if '--clear' in sys.argv:
+        cache.clear()
+    print(json.dumps(cache.stats(), indent=2))
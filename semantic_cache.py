@@ -0,0 +1,267 @@
+"""Semantic near-duplicate cache of chat answers for Event Horizon.
+
+Prompts are embedded locally (CPU only, nothing to download) as hashed
+TF-IDF vectors over content words and their character trigrams. A new prompt
+is compared with the earlier prompts answered under the same system context,
+and if the closest one scores above the caller's threshold its answer is
+reused. Answers are stored next to the exact-match cache in `cosmic_cache.db`;
+each process keeps its own in-memory index, loaded from disk on first use.
+"""
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from response_cache import CACHE_PATH, BUSY_TIMEOUT_SECONDS, DEFAULT_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSIONS = 2 ** 12
+DEFAULT_MAX_ENTRIES_PER_CONTEXT = 1000
+
+# Words that only frame a request, so "what is X" matches "explain X". Other interrogatives
+# ("how", "why"), negations and "show" (asks for a plot) change the answer and are kept.
+STOP_WORDS = frozenset("""
+a an the is are was were be been of to in on at for and or about what whats
+does do did can could would should please tell me explain describe define give i you your
+my it its this that these those there
+""".split())
+
+# Contractions spelled out before tokenizing, so the negation in "can't" survives as "not"
+CONTRACTIONS = [
+    (re.compile(r"\bcan['’]t\b"), "can not"),
+    (re.compile(r"\bwon['’]t\b"), "will not"),
+    (re.compile(r"n['’]t\b"), " not"),
+    (re.compile(r"\bcannot\b"), "can not"),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS semantic_responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    context_key TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_semantic_responses_context ON semantic_responses (context_key, created_at);
+"""
+
+# --- EMBEDDINGS ---
+def _content_words(text):
+    """Lowercase content words of a prompt, with plural 's' stripped."""
+    text = text.lower()
+    for pattern, replacement in CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    words = []
+    for word in re.findall(r'\w+', text):
+        if len(word) < 2 or word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+def embed(text):
+    """Sublinear term-frequency vector (1 + log count) of a prompt's hashed words and character trigrams."""
+    features = []
+    for word in _content_words(text):
+        features.append(word)
+        padded = f"<{word}>"
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    vector = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+    if features:
+        # crc32 rather than hash(): string hashes are randomized per process
+        hashed = np.array([zlib.crc32(feature.encode('utf-8')) % EMBEDDING_DIMENSIONS for feature in features])
+        indices, counts = np.unique(hashed, return_counts=True)
+        vector[indices] = 1 + np.log(counts)
+    return vector
+
+def context_key(context):
+    """Short stable key of a system context; answers are only reused under the same context."""
+    return hashlib.sha256(context.encode('utf-8')).hexdigest()
+
+class _ContextIndex:
+    """Brute-force cosine nearest-neighbour index over the prompts cached for one context.
+
+    Term frequencies are stored raw and IDF weights are applied at query time,
+    so adding or removing a prompt never requires re-embedding the others.
+    Vectors live in the first `len(ids)` rows of a matrix that grows by
+    doubling, so adding one is not a copy of all the others.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.matrix = np.zeros((16, EMBEDDING_DIMENSIONS), dtype=np.float32)  # Rows past len(ids) are spare
+        self.document_frequency = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+
+    def add(self, entry_id, vector):
+        count = len(self.ids)
+        if count == len(self.matrix):
+            grown = np.zeros((2 * count, EMBEDDING_DIMENSIONS), dtype=np.float32)
+            grown[:count] = self.matrix
+            self.matrix = grown
+        self.matrix[count] = vector
+        self.ids.append(entry_id)
+        self.document_frequency += vector > 0
+
+    def remove(self, entry_ids):
+        """Drop entries, keeping the others in insertion order."""
+        entry_ids = set(entry_ids)
+        keep = [row for row, entry_id in enumerate(self.ids) if entry_id not in entry_ids]
+        count = len(self.ids)
+        if len(keep) == count:
+            return
+        dropped = np.ones(count, dtype=bool)
+        dropped[keep] = False
+        self.document_frequency -= (self.matrix[:count][dropped] > 0).sum(axis=0)
+        self.matrix[:len(keep)] = self.matrix[keep]
+        self.matrix[len(keep):count] = 0
+        self.ids = [self.ids[row] for row in keep]
+
+    def nearest(self, vector):
+        """Return (entry ID, cosine similarity) of the closest prompt, or (None, 0.0)."""
+        if not self.ids:
+            return None, 0.0
+        idf = np.log((1 + len(self.ids)) / (1 + self.document_frequency)) + 1
+        query = vector * idf
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return None, 0.0
+        weighted = self.matrix[:len(self.ids)] * idf
+        norms = np.linalg.norm(weighted, axis=1) * query_norm
+        scores = (weighted @ query) / np.maximum(norms, 1e-12)
+        best = int(np.argmax(scores))
+        return self.ids[best], float(scores[best])
+
+# --- CACHE ---
+class SemanticCache:
+    """Reuse answers to earlier prompts that are worded differently but mean the same.
+
+    Entries expire after `ttl_seconds`; each context keeps its newest
+    `max_entries_per_context` prompts. Prompts cached by other server
+    processes are picked up when this process next loads that context.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_entries_per_context=DEFAULT_MAX_ENTRIES_PER_CONTEXT):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_context = max_entries_per_context
+        self.hits = 0
+        self.misses = 0
+        self._indexes = {}  # Context key -> _ContextIndex
+        self._versions = {}  # Context key -> stores so far, to spot stores that land during an index load
+        self._lock = threading.Lock()
+        self._schema_lock = threading.Lock()
+        self._thread_local = threading.local()
+        self._schema_ready = False
+
+    def _connection(self):
+        """Return the calling thread's connection, creating the schema on first use."""
+        db = getattr(self._thread_local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            with self._schema_lock:
+                if not self._schema_ready:
+                    db.executescript(f"BEGIN IMMEDIATE;{SCHEMA}COMMIT;")
+                    self._schema_ready = True
+            self._thread_local.db = db
+        return db
+
+    def _index(self, key):
+        """Return the in-memory index for a context, loading its unexpired prompts from disk on first use.
+
+        The load happens without holding the lock. If a store for the context
+        lands meanwhile, the loaded index may miss it, so it is used for this
+        lookup only and loaded again next time.
+        """
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                return index
+            version = self._versions.get(key, 0)
+
+        index = _ContextIndex()
+        rows = self._connection().execute(
+            "SELECT id, prompt FROM semantic_responses WHERE context_key = ? AND created_at >= ? ORDER BY created_at",
+            (key, time.time() - self.ttl_seconds)
+        ).fetchall()
+        for row in rows:
+            index.add(row['id'], embed(row['prompt']))
+
+        with self._lock:
+            if key in self._indexes:
+                return self._indexes[key]
+            if self._versions.get(key, 0) == version:
+                self._indexes[key] = index
+        return index
+
+    def lookup(self, context, prompt, threshold):
+        """Return (answer, similarity) for the closest earlier prompt scoring at least `threshold`, else None."""
+        vector = embed(prompt)
+        index = self._index(context_key(context))
+        with self._lock:
+            entry_id, score = index.nearest(vector)
+        row = None
+        if entry_id is not None:
+            row = self._connection().execute(
+                "SELECT prompt, text, created_at FROM semantic_responses WHERE id = ?", (entry_id,)
+            ).fetchone()
+
+        if row is None or score < threshold or time.time() - row['created_at'] > self.ttl_seconds:
+            with self._lock:
+                self.misses += 1
+            logger.info("Semantic cache miss (best similarity %.3f, threshold %.2f) for %r", score, threshold, prompt)
+            return None
+        with self._lock:
+            self.hits += 1
+        logger.info("Semantic cache hit (similarity %.3f, threshold %.2f): %r ~ %r", score, threshold, prompt, row['prompt'])
+        return row['text'], score
+
+    def store(self, context, prompt, answer):
+        """Remember an answer, evicting the context's oldest entries beyond the limit."""
+        key = context_key(context)
+        vector = embed(prompt)
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = db.execute(
+                "INSERT INTO semantic_responses (context_key, prompt, text, created_at) VALUES (?, ?, ?, ?)",
+                (key, prompt, answer, time.time())
+            )
+            evicted = [row['id'] for row in db.execute(
+                "SELECT id FROM semantic_responses WHERE context_key = ? AND id NOT IN "
+                "(SELECT id FROM semantic_responses WHERE context_key = ? ORDER BY created_at DESC LIMIT ?)",
+                (key, key, self.max_entries_per_context)
+            )]
+            db.executemany("DELETE FROM semantic_responses WHERE id = ?", [(entry_id,) for entry_id in evicted])
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            index = self._indexes.get(key)
+            if index is not None:
+                index.remove(evicted)
+                index.add(cursor.lastrowid, vector)
+
+    def stats(self):
+        """Return this process's hit/miss counters and the number of indexed prompts."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': sum(len(index.ids) for index in self._indexes.values())
+            }
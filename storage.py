@@ -0,0 +1,1074 @@
+"""SQLite-backed chat session storage for Event Horizon.
+
+Sessions and messages live in separate tables so that saving a message is a
+single-row append instead of a rewrite of the whole history file. The database
+runs in WAL mode: readers work on a consistent snapshot and never block on a
+writer, while writers from any thread or process serialize on SQLite's write
+lock (waiting up to BUSY_TIMEOUT_SECONDS) instead of overwriting each other.
+Generated media (images, audio) is kept out of the database in a
+content-addressed blob store; messages only carry a short
+`[IMAGE:sha256:...]` style reference.
+A session can be a branch of another: it stores only its own messages and
+shares the first `parent_message_count` messages of its parent's history.
+"""
+import base64
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+DB_PATH = 'cosmic_chats.db'
+LEGACY_DB_PATH = 'cosmic_chats.json'
+MEDIA_DIR = 'cosmic_media'
+ARCHIVE_DIR = 'cosmic_archive'
+BUSY_TIMEOUT_SECONDS = 30
+# Writes from other server processes become visible in the metadata cache after this long
+METADATA_CACHE_TTL_SECONDS = 30
+# Unreferenced blobs younger than this survive garbage collection: their message may not be committed yet
+BLOB_GC_GRACE_SECONDS = 24 * 60 * 60
+
+# Matches `[IMAGE:sha256:<hex>]text`, `[AUDIO:sha256:<hex>]text` and the legacy `[IMAGE:<base64>]text`.
+MEDIA_MESSAGE_PATTERN = re.compile(r'\[(IMAGE|AUDIO):([^\]]*)\]', re.DOTALL)
+
+# Columns the session history list may be sorted by.
+SESSION_SORT_COLUMNS = ('created_at', 'last_activity')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_name TEXT NOT NULL,
+    persona_name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    last_activity TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    dynamic_persona_description TEXT,
+    archived_at TEXT,
+    parent_session_id INTEGER,
+    parent_message_count INTEGER NOT NULL DEFAULT 0,
+    persona_message_count INTEGER NOT NULL DEFAULT 0,
+    persona_style TEXT,
+    context_summary TEXT,
+    context_summary_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    files TEXT,
+    suggestions TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session_ts ON messages (session_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions (created_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions (last_activity);
+
+-- Full-text search over session names and message bodies, kept in sync by triggers.
+CREATE VIRTUAL TABLE IF NOT EXISTS sessions_fts USING fts5(
+    session_name, content='sessions', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS sessions_fts_insert AFTER INSERT ON sessions BEGIN
+    INSERT INTO sessions_fts (rowid, session_name) VALUES (new.id, new.session_name);
+END;
+CREATE TRIGGER IF NOT EXISTS sessions_fts_delete AFTER DELETE ON sessions BEGIN
+    INSERT INTO sessions_fts (sessions_fts, rowid, session_name) VALUES ('delete', old.id, old.session_name);
+END;
+CREATE TRIGGER IF NOT EXISTS sessions_fts_rename AFTER UPDATE OF session_name ON sessions BEGIN
+    INSERT INTO sessions_fts (sessions_fts, rowid, session_name) VALUES ('delete', old.id, old.session_name);
+    INSERT INTO sessions_fts (rowid, session_name) VALUES (new.id, new.session_name);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+# Columns added to existing tables after their first release: (table, column, definition).
+ADDED_COLUMNS = [
+    ('sessions', 'archived_at', 'TEXT'),
+    ('sessions', 'parent_session_id', 'INTEGER'),
+    ('sessions', 'parent_message_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('sessions', 'persona_message_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('sessions', 'persona_style', 'TEXT'),
+    ('sessions', 'context_summary', 'TEXT'),
+    ('sessions', 'context_summary_count', 'INTEGER NOT NULL DEFAULT 0'),
+]
+# Indexes on added columns, created once the columns exist.
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_sessions_parent ON sessions (parent_session_id);
+"""
+
+# Ranks sessions by their best hit; session name matches count double. FTS5 ranks each
+# index's matches itself and only the best `:hit_limit` of each go on to the join and
+# grouping, so broad queries never join or group every matching message. Snippets are
+# only computed afterwards for the returned hits.
+SEARCH_QUERY = """
+SELECT sessions.*, MIN(hits.rank) AS rank, hits.source AS hit_source, hits.hit_id AS hit_id FROM (
+    SELECT 'name' AS source, best_names.rowid AS hit_id, best_names.rowid AS session_id, best_names.rank * 2.0 AS rank
+    FROM (
+        SELECT rowid, rank FROM sessions_fts WHERE sessions_fts MATCH :query ORDER BY rank LIMIT :hit_limit
+    ) AS best_names
+    UNION ALL
+    SELECT 'message', messages.id, messages.session_id, best_messages.rank
+    FROM (
+        SELECT rowid, rank FROM messages_fts WHERE messages_fts MATCH :query ORDER BY rank LIMIT :hit_limit
+    ) AS best_messages
+    JOIN messages ON messages.id = best_messages.rowid
+) AS hits
+JOIN sessions ON sessions.id = hits.session_id
+GROUP BY sessions.id
+ORDER BY rank
+LIMIT :limit
+"""
+# Best hits per FTS index kept per requested result
+SEARCH_HITS_PER_RESULT = 20
+SNIPPET_QUERIES = {
+    'name': "SELECT snippet(sessions_fts, 0, '**', '**', '…', 8) FROM sessions_fts WHERE sessions_fts MATCH ? AND rowid = ?",
+    'message': "SELECT snippet(messages_fts, 0, '**', '**', '…', 12) FROM messages_fts WHERE messages_fts MATCH ? AND rowid = ?"
+}
+
+# --- CONNECTION ---
+_thread_local = threading.local()
+_schema_lock = threading.Lock()
+_initialized_paths = set()
+
+class ChatDatabase(sqlite3.Connection):
+    """SQLite connection that can buffer storage writes for a unit of work."""
+    path = None
+    pending_writes = None  # List of queued (write callable, session ID to invalidate) while a unit of work is open
+
+def init_database(path=DB_PATH):
+    """Return the calling thread's connection to the chat database, opening it on first use.
+
+    Connections are never shared between threads, so parallel Streamlit sessions
+    cannot interleave each other's transactions. The schema is created once per
+    process.
+    """
+    connections = getattr(_thread_local, 'connections', None)
+    if connections is None:
+        connections = _thread_local.connections = {}
+    if path in connections:
+        return connections[path]
+
+    db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None, factory=ChatDatabase)
+    db.path = path
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    with _schema_lock:
+        if path not in _initialized_paths:
+            db.executescript(f"BEGIN IMMEDIATE;{SCHEMA}COMMIT;")
+            _upgrade_schema(db)
+            _initialized_paths.add(path)
+    connections[path] = db
+    return db
+
+def _upgrade_schema(db):
+    """Add the columns and indexes that databases created by older versions are missing."""
+    with _transaction(db):
+        for table, column, definition in ADDED_COLUMNS:
+            existing = {row['name'] for row in db.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    db.executescript(f"BEGIN IMMEDIATE;{ADDED_INDEXES}COMMIT;")
+
+@contextmanager
+def _transaction(db):
+    """Run the block in a write transaction that takes the database write lock up front.
+
+    `BEGIN IMMEDIATE` makes concurrent writers queue on the busy timeout rather
+    than failing when a read transaction tries to upgrade to a write.
+    """
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield db
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+
+def _write(db, apply, invalidates=None):
+    """Run a storage write in its own transaction, or queue it if a unit of work is open.
+
+    `invalidates` is the ID of a session whose cached metadata the write changes;
+    it is dropped from the cache once the write has committed. Returns the
+    result of `apply()`, or True when the write was queued.
+    """
+    if db.pending_writes is not None:
+        db.pending_writes.append((apply, invalidates))
+        return True
+    with _transaction(db):
+        result = apply()
+    if invalidates is not None:
+        session_metadata_cache.invalidate(db.path, invalidates)
+    return result
+
+@contextmanager
+def unit_of_work(db):
+    """Buffer every storage write made inside the block and commit them as one transaction.
+
+    Nothing is written if the block raises, so a failed chat turn never leaves
+    half of its messages behind. Nested blocks join the outermost one. Reads
+    inside the block do not see the buffered writes, and `create_new_session`
+    always writes immediately because callers need its ID.
+    """
+    if db.pending_writes is not None:
+        yield db
+        return
+
+    db.pending_writes = []
+    try:
+        yield db
+        pending_writes, db.pending_writes = db.pending_writes, None
+        with _transaction(db):
+            for apply, _ in pending_writes:
+                apply()
+        for _, invalidates in pending_writes:
+            if invalidates is not None:
+                session_metadata_cache.invalidate(db.path, invalidates)
+    finally:
+        db.pending_writes = None
+
+# --- SESSION METADATA CACHE ---
+class SessionMetadataCache:
+    """Process-wide cache of the session fields read on every rerun (name, persona and summary state).
+
+    Entries are dropped by the storage write functions of this process as soon
+    as their change commits, and expire after `ttl_seconds` so that writes from
+    other server processes are picked up too.
+    """
+    FIELDS = (
+        'session_name', 'persona_name', 'dynamic_persona_description', 'persona_message_count', 'persona_style',
+        'context_summary', 'context_summary_count'
+    )
+
+    def __init__(self, ttl_seconds=METADATA_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._versions = {}  # Key -> number of invalidations, to spot writes that commit during a read
+        self._lock = threading.Lock()
+
+    def get(self, db, session_id):
+        """Return the cached metadata dict for a session (None if it does not exist)."""
+        key = (db.path, session_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            version = self._versions.get(key, 0)
+
+        row = db.execute(
+            f"SELECT {', '.join(self.FIELDS)} FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        metadata = dict(row) if row else None
+        with self._lock:
+            # A write invalidated the session while we were reading: the row may predate it, so don't keep it
+            if self._versions.get(key, 0) == version:
+                self._entries[key] = (time.monotonic(), metadata)
+        return metadata
+
+    def invalidate(self, path, session_id):
+        """Forget a session's cached metadata."""
+        key = (path, session_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries)
+            }
+
+session_metadata_cache = SessionMetadataCache()
+
+def metadata_cache_stats():
+    """Hit/miss counters of the process-wide session metadata cache."""
+    return session_metadata_cache.stats()
+
+def _row_to_message(row):
+    """Convert a `messages` row into the message dict used by the UI."""
+    message = {
+        'role': row['role'],
+        'content': row['content'],
+        'timestamp': row['timestamp']
+    }
+    if row['files']:
+        message['files'] = json.loads(row['files'])
+    if row['suggestions']:
+        message['suggestions'] = json.loads(row['suggestions'])
+    return message
+
+def _row_to_session(row):
+    """Convert a `sessions` row into a session dict keyed like the old TinyDB documents."""
+    session = dict(row)
+    session['doc_id'] = session.pop('id')
+    return session
+
+# --- SESSION FUNCTIONS ---
+def create_new_session(db, session_name=None, persona_name="Cosmic Intelligence"):
+    """Create a new chat session."""
+    if session_name is None:
+        session_name = f"Cosmic Chat {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+
+    created_at = datetime.now().isoformat()
+    with _transaction(db):
+        cursor = db.execute(
+            "INSERT INTO sessions (session_name, persona_name, created_at, last_activity, dynamic_persona_description) VALUES (?, ?, ?, ?, NULL)",
+            (session_name, persona_name, created_at, created_at)
+        )
+    session_metadata_cache.invalidate(db.path, cursor.lastrowid)
+    return cursor.lastrowid
+
+def fork_session(db, parent_session_id, message_offset, session_name=None, persona_name=None):
+    """Create a branch of a session that shares its first `message_offset` messages.
+
+    The shared messages are not copied: the branch points at the parent and
+    only stores the messages added to it afterwards. Persona settings are
+    inherited unless `persona_name` is given. Returns the new session ID, or
+    None if the parent session does not exist.
+    """
+    with _transaction(db):
+        parent = db.execute("SELECT * FROM sessions WHERE id = ?", (parent_session_id,)).fetchone()
+        if parent is None:
+            return None
+        message_offset = max(0, min(message_offset, parent['message_count']))
+
+        # Point straight at the ancestor that stores the last shared message, keeping chains short
+        source = parent
+        while source['parent_session_id'] is not None and message_offset <= source['parent_message_count']:
+            source = db.execute("SELECT * FROM sessions WHERE id = ?", (source['parent_session_id'],)).fetchone()
+
+        created_at = datetime.now().isoformat()
+        cursor = db.execute(
+            "INSERT INTO sessions (session_name, persona_name, created_at, last_activity, message_count, dynamic_persona_description, "
+            "parent_session_id, parent_message_count, persona_message_count, persona_style, context_summary, context_summary_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                session_name or f"{parent['session_name']} (branch)",
+                persona_name or parent['persona_name'],
+                created_at, created_at, message_offset,
+                parent['dynamic_persona_description'],
+                source['id'] if message_offset else None,
+                message_offset,
+                min(parent['persona_message_count'], message_offset),
+                parent['persona_style'],
+                # A summary is only reusable if it covers no messages beyond the branch point
+                *((parent['context_summary'], parent['context_summary_count'])
+                  if parent['context_summary_count'] <= message_offset else (None, 0))
+            )
+        )
+    session_metadata_cache.invalidate(db.path, cursor.lastrowid)
+    return cursor.lastrowid
+
+def _session_chain(db, session_id):
+    """Return the (session ID, own message limit) segments making up a session's history, root first.
+
+    A branch's history is the first `parent_message_count` messages of its
+    parent's history followed by its own messages, recursively. The limit is
+    None for the session itself, whose messages are all visible.
+    """
+    chain = []
+    visible = None
+    while session_id is not None:
+        row = db.execute("SELECT parent_session_id, parent_message_count FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            break
+        inherited = row['parent_message_count'] if row['parent_session_id'] is not None else 0
+        chain.append((session_id, None if visible is None else max(0, visible - inherited)))
+        visible = inherited if visible is None else min(visible, inherited)
+        session_id = row['parent_session_id']
+    return chain[::-1]
+
+def get_all_sessions(db):
+    """Get all chat sessions, newest first. Message bodies are not loaded."""
+    rows = db.execute("SELECT * FROM sessions ORDER BY created_at DESC").fetchall()
+    return [_row_to_session(row) for row in rows]
+
+def get_sessions_page(db, limit=10, offset=0, order_by='created_at'):
+    """Get one page of session metadata, newest first by `created_at` or `last_activity`."""
+    if order_by not in SESSION_SORT_COLUMNS:
+        raise ValueError(f"Cannot sort sessions by '{order_by}'.")
+    rows = db.execute(
+        f"SELECT * FROM sessions ORDER BY {order_by} DESC, id DESC LIMIT ? OFFSET ?",
+        (limit, offset)
+    ).fetchall()
+    return [_row_to_session(row) for row in rows]
+
+def count_sessions(db):
+    """Count all chat sessions."""
+    return db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+def count_session_messages(db, session_id):
+    """Count the messages in a session's history, including those shared with its parent."""
+    row = db.execute("SELECT message_count FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    return row['message_count'] if row else 0
+
+def save_message(db, session_id, role, content, files=None, suggestions=None):
+    """Append a message to a session and refresh the session's metadata."""
+    message = {
+        'role': role,
+        'content': content,
+        'timestamp': datetime.now().isoformat()
+    }
+    if files:
+        message['files'] = files
+    if suggestions:
+        message['suggestions'] = suggestions
+
+    def apply():
+        session = db.execute("SELECT archived_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if session is None:
+            return False
+        if session['archived_at'] is not None:
+            # Reads of an archived session only look at its archive, so bring it back before appending.
+            # The archive file is left behind: it is ignored once the session is hot and replaced if it is archived again.
+            try:
+                with gzip.open(_archive_path(session_id), 'rt', encoding='utf-8') as f:
+                    archived_rows = [json.loads(line) for line in f]
+            except FileNotFoundError:
+                archived_rows = []  # Lost archive; reads already fall back to the hot rows
+            _restore_archived_rows(db, session_id, archived_rows)
+        db.execute(
+            "UPDATE sessions SET message_count = message_count + 1, last_activity = ? WHERE id = ?",
+            (message['timestamp'], session_id)
+        )
+        db.execute(
+            "INSERT INTO messages (session_id, role, content, timestamp, files, suggestions) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                session_id, role, content, message['timestamp'],
+                json.dumps(files) if files else None,
+                json.dumps(suggestions) if suggestions else None
+            )
+        )
+        return True
+
+    return message if _write(db, apply) else None
+
+def set_message_suggestions(db, session_id, timestamp, suggestions):
+    """Attach follow-up suggestions to an assistant message that has already been saved."""
+    _write(db, lambda: db.execute(
+        "UPDATE messages SET suggestions = ? WHERE session_id = ? AND timestamp = ? AND role = 'assistant'",
+        (json.dumps(suggestions) if suggestions else None, session_id, timestamp)
+    ))
+
+def _to_fts_query(text):
+    """Turn free text into a safe FTS5 query: every word must match, the last one as a prefix."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    quoted = [f'"{word}"' for word in words]
+    quoted[-1] += '*'
+    return " ".join(quoted)
+
+def search_sessions(db, query, limit=10):
+    """Rank sessions by how well their name and messages match `query`.
+
+    Each result is a session dict with an extra `snippet` of the best match.
+    """
+    fts_query = _to_fts_query(query)
+    if fts_query is None:
+        return []
+    rows = db.execute(
+        SEARCH_QUERY,
+        {'query': fts_query, 'limit': limit, 'hit_limit': limit * SEARCH_HITS_PER_RESULT}
+    ).fetchall()
+    sessions = []
+    for row in rows:
+        session = _row_to_session(row)
+        hit_source, hit_id = session.pop('hit_source'), session.pop('hit_id')
+        session.pop('rank')
+        snippet_row = db.execute(SNIPPET_QUERIES[hit_source], (fts_query, hit_id)).fetchone()
+        session['snippet'] = snippet_row[0] if snippet_row else ""
+        sessions.append(session)
+    return sessions
+
+def load_session_messages(db, session_id):
+    """Load all messages for a session, following its branch chain and rehydrating archived parts."""
+    messages = []
+    for segment_id, own_limit in _session_chain(db, session_id):
+        if own_limit == 0:
+            continue
+        _rehydrate_session(db, segment_id)
+        rows = db.execute(
+            "SELECT * FROM messages WHERE session_id = ? ORDER BY timestamp, id LIMIT ?",
+            (segment_id, -1 if own_limit is None else own_limit)
+        ).fetchall()
+        messages.extend(_row_to_message(row) for row in rows)
+    return messages
+
+def load_session_messages_page(db, session_id, limit=20, before=None):
+    """Load the newest `limit` messages older than the `before` cursor.
+
+    Returns (messages, cursor) with messages in chronological order. Pass the
+    cursor back as `before` to fetch the previous page; it is None once the
+    start of the conversation has been reached. For branches, pages continue
+    into the history shared with the parent.
+    """
+    rows = []
+    for segment_id, own_limit in reversed(_session_chain(db, session_id)):
+        if own_limit == 0:
+            continue
+        _rehydrate_session(db, segment_id)
+        conditions, params = ["session_id = ?"], [segment_id]
+        if own_limit is not None:
+            # Only the first `own_limit` messages of an ancestor are part of this history
+            last_shared = db.execute(
+                "SELECT timestamp, id FROM messages WHERE session_id = ? ORDER BY timestamp, id LIMIT 1 OFFSET ?",
+                (segment_id, own_limit - 1)
+            ).fetchone()
+            if last_shared is not None:
+                conditions.append("(timestamp < ? OR (timestamp = ? AND id <= ?))")
+                params += [last_shared['timestamp'], last_shared['timestamp'], last_shared['id']]
+        if before is not None:
+            before_timestamp, before_id = before
+            conditions.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+            params += [before_timestamp, before_timestamp, before_id]
+        rows += db.execute(
+            f"SELECT * FROM messages WHERE {' AND '.join(conditions)} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            params + [limit + 1 - len(rows)]
+        ).fetchall()
+        if len(rows) > limit:
+            break
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = (rows[-1]['timestamp'], rows[-1]['id']) if has_more else None
+    return [_row_to_message(row) for row in reversed(rows)], cursor
+
+def delete_session(db, session_id):
+    """Delete a chat session, its messages and its archive (if any).
+
+    Branches of the session keep their full history: the messages they shared
+    with it are copied into them and they are re-pointed at its parent. Media
+    no other message references is removed by the next `collect_unreferenced_blobs`.
+    """
+    branch_ids = [row['id'] for row in db.execute("SELECT id FROM sessions WHERE parent_session_id = ?", (session_id,))]
+    if branch_ids:
+        for rehydrate_id in [session_id] + branch_ids:
+            _rehydrate_session(db, rehydrate_id)
+
+    def apply():
+        _detach_branches(db, session_id)
+        db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        if os.path.exists(_archive_path(session_id)):
+            os.remove(_archive_path(session_id))
+    _write(db, apply, invalidates=session_id)
+
+def _detach_branches(db, session_id):
+    """Make the branches of a session independent of its own messages before it is deleted."""
+    session = db.execute("SELECT parent_session_id, parent_message_count FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    if session is None:
+        return
+    inherited = session['parent_message_count'] if session['parent_session_id'] is not None else 0
+    branches = db.execute("SELECT id, parent_message_count FROM sessions WHERE parent_session_id = ?", (session_id,)).fetchall()
+    for branch in branches:
+        copied = branch['parent_message_count'] - inherited
+        if copied > 0:
+            db.execute(
+                "INSERT INTO messages (session_id, role, content, timestamp, files, suggestions) "
+                "SELECT ?, role, content, timestamp, files, suggestions FROM messages WHERE session_id = ? ORDER BY timestamp, id LIMIT ?",
+                (branch['id'], session_id, copied)
+            )
+        still_shared = min(branch['parent_message_count'], inherited)
+        db.execute(
+            "UPDATE sessions SET parent_session_id = ?, parent_message_count = ? WHERE id = ?",
+            (session['parent_session_id'] if still_shared else None, still_shared, branch['id'])
+        )
+
+def rename_session(db, session_id, new_name):
+    """Rename a chat session."""
+    _write(db, lambda: db.execute("UPDATE sessions SET session_name = ? WHERE id = ?", (new_name, session_id)), invalidates=session_id)
+
+def get_session_name(db, session_id):
+    """Get session name by ID."""
+    metadata = session_metadata_cache.get(db, session_id)
+    return metadata['session_name'] if metadata else 'Unknown'
+
+def get_session_persona(db, session_id):
+    """Get session persona by ID."""
+    metadata = session_metadata_cache.get(db, session_id)
+    return metadata['persona_name'] if metadata else 'Cosmic Intelligence'
+
+def update_session_persona(db, session_id, new_persona_name):
+    """Update the persona for a specific chat session."""
+    _write(db, lambda: db.execute("UPDATE sessions SET persona_name = ? WHERE id = ?", (new_persona_name, session_id)), invalidates=session_id)
+
+def get_session_persona_description(db, session_id):
+    """Get the evolved Cognitive Twin persona description of a session (None if it has not evolved yet)."""
+    metadata = session_metadata_cache.get(db, session_id)
+    return metadata['dynamic_persona_description'] if metadata else None
+
+def get_session_persona_evolution(db, session_id):
+    """Get (description, messages covered, style profile dict) of a session's Cognitive Twin persona."""
+    metadata = session_metadata_cache.get(db, session_id)
+    if not metadata:
+        return None, 0, None
+    style = json.loads(metadata['persona_style']) if metadata['persona_style'] else None
+    return metadata['dynamic_persona_description'], metadata['persona_message_count'], style
+
+def update_session_persona_description(db, session_id, description, message_count=None, style=None):
+    """Store the evolved Cognitive Twin persona description for a session.
+
+    `message_count` is how many messages of the history the description
+    covers, and `style` the stylometric profile it was evolved for.
+    """
+    if message_count is None:
+        _write(db, lambda: db.execute("UPDATE sessions SET dynamic_persona_description = ? WHERE id = ?", (description, session_id)), invalidates=session_id)
+        return
+    _write(db, lambda: db.execute(
+        "UPDATE sessions SET dynamic_persona_description = ?, persona_message_count = ?, persona_style = ? WHERE id = ?",
+        (description, message_count, json.dumps(style) if style else None, session_id)
+    ), invalidates=session_id)
+
+def get_session_context_summary(db, session_id):
+    """Get (summary, messages covered) of a session's older conversation turns; (None, 0) if none yet."""
+    metadata = session_metadata_cache.get(db, session_id)
+    if not metadata or not metadata['context_summary']:
+        return None, 0
+    return metadata['context_summary'], metadata['context_summary_count']
+
+def update_session_context_summary(db, session_id, summary, message_count):
+    """Store the rolling summary covering the first `message_count` messages of a session's history."""
+    _write(db, lambda: db.execute(
+        "UPDATE sessions SET context_summary = ?, context_summary_count = ? WHERE id = ?",
+        (summary, message_count, session_id)
+    ), invalidates=session_id)
+
+# --- MEDIA BLOB STORE ---
+def _blob_path(digest, media_dir=MEDIA_DIR):
+    """Path of a blob inside the store, sharded by the first two hex digits."""
+    return os.path.join(media_dir, digest[:2], digest)
+
+def put_blob(data, media_dir=MEDIA_DIR):
+    """Write bytes to the blob store once and return their SHA-256 digest."""
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(digest, media_dir)
+    try:
+        os.utime(path)  # Already stored: refresh its age so garbage collection keeps it
+        return digest
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return digest
+
+def get_blob(digest, media_dir=MEDIA_DIR):
+    """Read a blob by digest. Returns None if it is missing."""
+    try:
+        with open(_blob_path(digest, media_dir), 'rb') as f:
+            return f.read()
+    except (OSError, ValueError):
+        return None
+
+def make_media_message(kind, data, text="", media_dir=MEDIA_DIR):
+    """Store media bytes and return message content referencing them, e.g. `[IMAGE:sha256:...]text`."""
+    digest = put_blob(data, media_dir)
+    return f"[{kind.upper()}:sha256:{digest}]{text}"
+
+def parse_media_message(content):
+    """Split media message content into (kind, ref, text) without loading the media.
+
+    `kind` is 'image' or 'audio'. Returns None for plain text messages.
+    """
+    match = MEDIA_MESSAGE_PATTERN.match(content or "")
+    if not match:
+        return None
+    return match.group(1).lower(), match.group(2), content[match.end():]
+
+def load_media(ref, media_dir=MEDIA_DIR):
+    """Resolve a media reference from `parse_media_message` to bytes (None if unavailable)."""
+    if ref.startswith('sha256:'):
+        return get_blob(ref[len('sha256:'):], media_dir)
+    try:
+        return base64.b64decode(ref)  # Legacy inline base64 image
+    except ValueError:
+        return None
+
+def _externalize_legacy_media(content, media_dir=MEDIA_DIR):
+    """Move an inline `[IMAGE:<base64>]` payload into the blob store."""
+    media = parse_media_message(content)
+    if media is None or media[1].startswith('sha256:'):
+        return content
+    data = load_media(media[1], media_dir)
+    if data is None:
+        return content
+    return make_media_message(media[0], data, media[2], media_dir)
+
+# --- COLD SESSION ARCHIVE ---
+def _archive_path(session_id, archive_dir=ARCHIVE_DIR):
+    """Path of the gzip archive holding an archived session's messages."""
+    return os.path.join(archive_dir, f"session_{session_id}.jsonl.gz")
+
+def archive_idle_sessions(db, max_idle_days=30, archive_dir=ARCHIVE_DIR):
+    """Move the messages of sessions idle for more than `max_idle_days` into gzip archives.
+
+    Archived sessions keep their metadata row, so they stay in the history list,
+    and `load_session_messages` restores them on demand. Their message bodies
+    are not searchable until then. Sessions with branches that are still hot
+    stay hot too, since every branch load reads their messages. The hot
+    database is vacuumed afterwards. Returns the number of sessions archived.
+    """
+    cutoff = (datetime.now() - timedelta(days=max_idle_days)).isoformat()
+    candidates = db.execute(
+        "SELECT id, last_activity FROM sessions WHERE archived_at IS NULL AND message_count > 0 AND last_activity < ? "
+        "AND NOT EXISTS (SELECT 1 FROM sessions AS branches WHERE branches.parent_session_id = sessions.id AND branches.archived_at IS NULL)",
+        (cutoff,)
+    ).fetchall()
+
+    archived = 0
+    for candidate in candidates:
+        if _archive_session(db, candidate['id'], candidate['last_activity'], archive_dir):
+            archived += 1
+    if archived:
+        db.execute('VACUUM')
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return archived
+
+def _archive_session(db, session_id, last_activity, archive_dir=ARCHIVE_DIR):
+    """Write one session's messages to its archive, then drop them from the hot store.
+
+    The archive is written to a private temporary file and only moved into
+    place by the transaction that marks the session archived, so when several
+    processes archive the same session at once, the losers never touch the
+    winner's archive.
+    """
+    rows = db.execute(
+        "SELECT id, role, content, timestamp, files, suggestions FROM messages WHERE session_id = ? ORDER BY timestamp, id",
+        (session_id,)
+    ).fetchall()
+
+    os.makedirs(archive_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=archive_dir)
+    os.close(fd)
+    try:
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(dict(row)) + "\n")
+
+        with _transaction(db):
+            session = db.execute("SELECT last_activity, archived_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            # Skip sessions that were deleted, archived or written to since they were selected
+            still_idle = session is not None and session['archived_at'] is None and session['last_activity'] == last_activity
+            if still_idle:
+                db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                db.execute("UPDATE sessions SET archived_at = ? WHERE id = ?", (datetime.now().isoformat(), session_id))
+                os.replace(tmp_path, _archive_path(session_id, archive_dir))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return still_idle
+
+def _rehydrate_session(db, session_id, archive_dir=ARCHIVE_DIR):
+    """Restore an archived session's messages into the hot store. No-op for hot sessions."""
+    session = db.execute("SELECT archived_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    if session is None or session['archived_at'] is None:
+        return
+
+    path = _archive_path(session_id, archive_dir)
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            archived_rows = [json.loads(line) for line in f]
+    except FileNotFoundError:
+        return  # Another thread or process has already rehydrated it
+
+    with _transaction(db):
+        session = db.execute("SELECT archived_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if session is None or session['archived_at'] is None:
+            return
+        _restore_archived_rows(db, session_id, archived_rows)
+    os.remove(path)
+
+def _restore_archived_rows(db, session_id, archived_rows):
+    """Put an archived session's rows back into the hot store and mark it hot. Call inside a write transaction."""
+    db.executemany(
+        "INSERT INTO messages (id, session_id, role, content, timestamp, files, suggestions) "
+        "VALUES (:id, :session_id, :role, :content, :timestamp, :files, :suggestions)",
+        [dict(row, session_id=session_id) for row in archived_rows]
+    )
+    db.execute("UPDATE sessions SET archived_at = NULL WHERE id = ?", (session_id,))
+
+# --- MEDIA GARBAGE COLLECTION ---
+def _blob_digests(contents):
+    """Digests of the blobs referenced by an iterable of message contents."""
+    digests = set()
+    for content in contents:
+        media = parse_media_message(content)
+        if media is not None and media[1].startswith('sha256:'):
+            digests.add(media[1][len('sha256:'):])
+    return digests
+
+def _referenced_blobs(db, archive_dir=ARCHIVE_DIR):
+    """Digests referenced by any message, hot or archived."""
+    # One snapshot for the hot messages and the list of archived sessions, so no session falls in between
+    db.execute('BEGIN')
+    try:
+        referenced = _blob_digests(row[0] for row in db.execute(
+            "SELECT content FROM messages WHERE content LIKE '[IMAGE:sha256:%' OR content LIKE '[AUDIO:sha256:%'"
+        ))
+        archived_ids = [row[0] for row in db.execute("SELECT id FROM sessions WHERE archived_at IS NOT NULL")]
+    finally:
+        db.execute('COMMIT')
+
+    for session_id in archived_ids:
+        try:
+            with gzip.open(_archive_path(session_id, archive_dir), 'rt', encoding='utf-8') as f:
+                referenced |= _blob_digests(json.loads(line)['content'] for line in f)
+        except FileNotFoundError:
+            # Rehydrated since the snapshot, so its messages are back in the hot store
+            referenced |= _blob_digests(row[0] for row in db.execute("SELECT content FROM messages WHERE session_id = ?", (session_id,)))
+    return referenced
+
+def collect_unreferenced_blobs(db, media_dir=MEDIA_DIR, archive_dir=ARCHIVE_DIR, grace_seconds=BLOB_GC_GRACE_SECONDS):
+    """Delete the blobs no message references any more, e.g. media of deleted chats.
+
+    Blobs stored or reused within the last `grace_seconds` are kept, as the
+    message referencing them may still be uncommitted. Returns (blobs, bytes) removed.
+    """
+    if not os.path.isdir(media_dir):
+        return 0, 0
+    cutoff = time.time() - grace_seconds
+    referenced = _referenced_blobs(db, archive_dir)
+
+    removed, freed = 0, 0
+    for shard in os.scandir(media_dir):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.name in referenced or not re.fullmatch(r'[0-9a-f]{64}', entry.name):
+                continue
+            try:
+                stat = entry.stat()
+                if stat.st_mtime >= cutoff:
+                    continue
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += stat.st_size
+    return removed, freed
+
+# --- EXPORT ---
+def iter_session_messages(db, session_id, batch_size=500, start=0):
+    """Yield a session's messages in chronological order, `batch_size` rows at a time.
+
+    Branches include the history they share with their parent. Archived
+    sessions are streamed straight from their archive without being
+    rehydrated, so exporting old history does not undo archival. The first
+    `start` messages are skipped: whole segments by their message counts, and
+    hot rows by seeking on the index without reading them.
+    """
+    for segment_id, own_limit in _session_chain(db, session_id):
+        if own_limit == 0:
+            continue
+        if start:
+            row = db.execute(
+                "SELECT message_count, parent_session_id, parent_message_count FROM sessions WHERE id = ?", (segment_id,)
+            ).fetchone()
+            own_count = row['message_count'] - (row['parent_message_count'] if row['parent_session_id'] is not None else 0)
+            visible = own_count if own_limit is None else min(own_limit, own_count)
+            if start >= visible:
+                start -= visible
+                continue
+        yield from _iter_own_messages(db, segment_id, own_limit, batch_size, offset=start)
+        start = 0
+
+def _iter_own_messages(db, session_id, limit, batch_size, offset=0):
+    """Yield the first `limit` (None for all) messages stored in one session, skipping the first `offset`."""
+    if limit is not None and offset >= limit:
+        return
+    path = _archive_path(session_id)
+    session = db.execute("SELECT archived_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    if session is not None and session['archived_at'] is not None and os.path.exists(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in itertools.islice(f, offset, limit):
+                yield _row_to_message(json.loads(line))
+        return
+
+    remaining = -1 if limit is None else limit - offset
+    last = None
+    if offset:
+        # Seek past the skipped messages on the index alone, without reading their rows
+        last = db.execute(
+            "SELECT timestamp, id FROM messages WHERE session_id = ? ORDER BY timestamp, id LIMIT 1 OFFSET ?",
+            (session_id, offset - 1)
+        ).fetchone()
+        if last is None:
+            return
+    while remaining != 0:
+        batch = batch_size if remaining < 0 else min(batch_size, remaining)
+        if last is None:
+            rows = db.execute(
+                "SELECT * FROM messages WHERE session_id = ? ORDER BY timestamp, id LIMIT ?", (session_id, batch)
+            ).fetchall()
+        else:
+            rows = db.execute(
+                "SELECT * FROM messages WHERE session_id = ? AND (timestamp > ? OR (timestamp = ? AND id > ?)) "
+                "ORDER BY timestamp, id LIMIT ?",
+                (session_id, last['timestamp'], last['timestamp'], last['id'], batch)
+            ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield _row_to_message(row)
+        if remaining >= 0:
+            remaining -= len(rows)
+        last = rows[-1]
+
+def iter_chat_markdown(messages, session_name):
+    """Yield a Markdown transcript of `messages` one message at a time.
+
+    Stored media is linked as `media/<digest>`, where the export ZIPs put it.
+    """
+    yield f"# Chat History: {session_name}\n\n"
+    for message in messages:
+        role = "🧑‍🚀 User" if message["role"] == "user" else "🌌 AI"
+        content = message['content']
+        media = parse_media_message(content)
+        if media is not None and media[1].startswith('sha256:'):
+            kind, ref, text = media
+            digest = ref[len('sha256:'):]
+            link = f"![image](media/{digest})" if kind == 'image' else f"[🔊 audio](media/{digest})"
+            content = f"{link}\n\n{text}" if text else link
+        yield f"**{role}:**\n{content}\n\n---\n\n"
+
+def iter_chat_jsonl(messages):
+    """Yield `messages` as JSON Lines, one message per line."""
+    for message in messages:
+        yield json.dumps(message, ensure_ascii=False) + "\n"
+
+def write_chunks(chunks, path):
+    """Write an iterable of text chunks to a UTF-8 file without joining them in memory."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return path
+
+def _noting_media(messages, digests):
+    """Pass `messages` through, adding the digests of the blobs they reference to `digests`."""
+    for message in messages:
+        media = parse_media_message(message['content'])
+        if media is not None and media[1].startswith('sha256:'):
+            digests.add(media[1][len('sha256:'):])
+        yield message
+
+def _write_zip_text(archive, file_name, chunks):
+    with archive.open(file_name, 'w', force_zip64=True) as f:
+        for chunk in chunks:
+            f.write(chunk.encode('utf-8'))
+
+def _write_zip_media(archive, digests, media_dir=MEDIA_DIR):
+    """Copy the referenced blobs into the archive as `media/<digest>`, skipping missing ones."""
+    for digest in sorted(digests):
+        path = _blob_path(digest, media_dir)
+        if os.path.exists(path):
+            archive.write(path, f"media/{digest}")
+
+def write_session_zip(db, session_id, session_name, fileobj, media_dir=MEDIA_DIR):
+    """Stream one session into a self-contained ZIP: `chat.md`, `chat.jsonl` and the media they reference."""
+    digests = set()
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+        _write_zip_text(archive, "chat.md", iter_chat_markdown(_noting_media(iter_session_messages(db, session_id), digests), session_name))
+        _write_zip_text(archive, "chat.jsonl", iter_chat_jsonl(iter_session_messages(db, session_id)))
+        _write_zip_media(archive, digests, media_dir)
+    return fileobj
+
+def write_all_sessions_zip(db, fileobj, page_size=100, media_dir=MEDIA_DIR):
+    """Stream every session into a ZIP archive as one Markdown and one JSONL file each, plus their media."""
+    digests = set()
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+        offset = 0
+        while True:
+            sessions = get_sessions_page(db, limit=page_size, offset=offset)
+            if not sessions:
+                break
+            for session in sessions:
+                safe_name = "".join(c for c in session['session_name'] if c.isalnum() or c in (' ', '_')).strip().replace(' ', '_')
+                base_name = f"{session['doc_id']:05d}_{safe_name or 'session'}"
+                messages = _noting_media(iter_session_messages(db, session['doc_id']), digests)
+                _write_zip_text(archive, f"{base_name}.md", iter_chat_markdown(messages, session['session_name']))
+                _write_zip_text(archive, f"{base_name}.jsonl", iter_chat_jsonl(iter_session_messages(db, session['doc_id'])))
+            offset += page_size
+        _write_zip_media(archive, digests, media_dir)
+    return fileobj
+
+# --- MIGRATION ---
+def migrate_from_tinydb(db, json_path=LEGACY_DB_PATH):
+    """Copy sessions and messages from a legacy TinyDB `cosmic_chats.json` file.
+
+    Session IDs are preserved. Sessions whose ID already exists are skipped, so
+    running the migration twice is harmless. Inline base64 images are moved into
+    the media blob store. Returns (sessions, messages) copied.
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        legacy = json.load(f)
+
+    migrated_sessions = 0
+    migrated_messages = 0
+    with _transaction(db):
+        for doc_id, session in legacy.get('sessions', {}).items():
+            created_at = session.get('created_at', datetime.now().isoformat())
+            messages = session.get('messages', [])
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO sessions (id, session_name, persona_name, created_at, last_activity, message_count, dynamic_persona_description) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    int(doc_id),
+                    session.get('session_name', 'Unnamed Chat'),
+                    session.get('persona_name', 'Cosmic Intelligence'),
+                    created_at,
+                    max([created_at] + [msg.get('timestamp', created_at) for msg in messages]),
+                    len(messages),
+                    session.get('dynamic_persona_description')
+                )
+            )
+            if cursor.rowcount == 0:
+                continue
+            migrated_sessions += 1
+
+            for msg in messages:
+                db.execute(
+                    "INSERT INTO messages (session_id, role, content, timestamp, files, suggestions) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        int(doc_id), msg['role'], _externalize_legacy_media(msg['content']),
+                        msg.get('timestamp', created_at),
+                        json.dumps(msg['files']) if msg.get('files') else None,
+                        json.dumps(msg['suggestions']) if msg.get('suggestions') else None
+                    )
+                )
+                migrated_messages += 1
+    return migrated_sessions, migrated_messages
+
+if __name__ == "__main__":
+    # Usage: python storage.py [cosmic_chats.json] [cosmic_chats.db]
+    source = sys.argv[1] if len(sys.argv) > 1 else LEGACY_DB_PATH
+    target = sys.argv[2] if len(sys.argv) > 2 else DB_PATH
+    sessions_copied, messages_copied = migrate_from_tinydb(init_database(target), source)
+    print(f"Migrated {sessions_copied} sessions and {messages_copied} messages from '{source}' into '{target}'.")
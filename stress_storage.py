@@ -0,0 +1,131 @@
+"""Concurrency stress test for the chat storage layer.
+
+Hammers `save_message` from many threads in several processes against one
+database file while other threads keep reading, then checks that no message
+was lost or duplicated and that the session metadata and search index agree.
+
+Usage: python stress_storage.py [--processes 4] [--threads 8] [--messages 200]
+Exits with status 1 if any check fails.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from storage import (
+    init_database, create_new_session, save_message, load_session_messages,
+    load_session_messages_page, get_sessions_page, unit_of_work
+)
+
+def writer_thread(db_path, session_ids, worker_name, message_count, errors):
+    """Append `message_count` uniquely named messages, spread across all sessions."""
+    try:
+        db = init_database(db_path)
+        for i in range(message_count):
+            session_id = session_ids[i % len(session_ids)]
+            content = f"{worker_name}-{i}"
+            if i % 10 == 0:
+                # Exercise grouped writes as well as single-message commits
+                with unit_of_work(db):
+                    message = save_message(db, session_id, "user", content)
+            else:
+                message = save_message(db, session_id, "user", content)
+            if message is None:
+                errors.append(f"{content}: session {session_id} not found")
+    except Exception as e:
+        errors.append(f"{worker_name}: {e!r}")
+
+def reader_thread(db_path, session_ids, stop_event, errors):
+    """Keep reading pages and session metadata until the writers are done."""
+    try:
+        db = init_database(db_path)
+        while not stop_event.is_set():
+            for session_id in session_ids:
+                load_session_messages_page(db, session_id)
+            get_sessions_page(db)
+    except Exception as e:
+        errors.append(f"reader: {e!r}")
+
+def worker_process(db_path, session_ids, process_index, thread_count, message_count, error_queue):
+    """Run writer threads plus one reader thread inside a single process."""
+    errors = []
+    stop_event = threading.Event()
+    reader = threading.Thread(target=reader_thread, args=(db_path, session_ids, stop_event, errors))
+    reader.start()
+    writers = [
+        threading.Thread(target=writer_thread, args=(db_path, session_ids, f"p{process_index}t{t}", message_count, errors))
+        for t in range(thread_count)
+    ]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    stop_event.set()
+    reader.join()
+    error_queue.put(errors)
+
+def verify(db_path, session_ids, process_count, thread_count, message_count):
+    """Return a list of problems found in the final database state."""
+    db = init_database(db_path)
+    problems = []
+
+    expected = {f"p{p}t{t}-{i}" for p in range(process_count) for t in range(thread_count) for i in range(message_count)}
+    saved = [msg['content'] for session_id in session_ids for msg in load_session_messages(db, session_id)]
+    if len(saved) != len(set(saved)):
+        problems.append(f"{len(saved) - len(set(saved))} duplicated messages")
+    missing = expected - set(saved)
+    if missing:
+        problems.append(f"{len(missing)} lost messages, e.g. {sorted(missing)[:5]}")
+
+    counted = db.execute("SELECT SUM(message_count) FROM sessions").fetchone()[0]
+    if counted != len(saved):
+        problems.append(f"sessions.message_count sums to {counted}, but {len(saved)} messages are stored")
+    indexed = db.execute("SELECT COUNT(*) FROM messages_fts").fetchone()[0]
+    if indexed != len(saved):
+        problems.append(f"search index holds {indexed} messages, but {len(saved)} are stored")
+    integrity = db.execute("PRAGMA integrity_check").fetchone()[0]
+    if integrity != 'ok':
+        problems.append(f"integrity check failed: {integrity}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=200, help="Messages written by each thread")
+    parser.add_argument("--sessions", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "stress.db")
+        db = init_database(db_path)
+        session_ids = [create_new_session(db, f"Stress {i}") for i in range(args.sessions)]
+
+        start = time.perf_counter()
+        error_queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker_process, args=(db_path, session_ids, p, args.threads, args.messages, error_queue))
+            for p in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        errors = [error for _ in processes for error in error_queue.get()]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        total = args.processes * args.threads * args.messages
+        problems = errors + verify(db_path, session_ids, args.processes, args.threads, args.messages)
+
+    print(f"{total} messages from {args.processes} processes x {args.threads} threads in {elapsed:.2f}s ({total / elapsed:.0f} msg/s)")
+    if problems:
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        sys.exit(1)
+    print("OK: no messages lost or duplicated")
+
+if __name__ == "__main__":
+    main()